@@ -29,14 +29,48 @@ import json
 import time
 import syslog
 import socket
-from multiprocessing import Process
+import threading
+from multiprocessing.pool import ThreadPool
+try:
+    import Queue
+except ImportError:
+    import queue as Queue
+from collections import namedtuple
 from datetime import datetime
 import base64
+import math
+import bisect
 import logging
 import traceback
 import argparse
+import atexit
 import sys
 import os
+import zlib
+import struct
+import re
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import BaseHTTPServer
+    import SocketServer
+except ImportError:
+    import http.server as BaseHTTPServer
+    import socketserver as SocketServer
+#----- The json module of python 2 decodes large responses several times
+#----- slower than simplejson or ujson, either is used when installed.  On
+#----- python 3 the json module is as fast and is always used.
+fast_json = json
+if sys.version_info[0] == 2:
+    try:
+        import simplejson as fast_json
+    except ImportError:
+        try:
+            import ujson as fast_json
+        except ImportError:
+            pass
 
 
 
@@ -47,7 +81,11 @@ parser.add_argument('-t', '--test', help='-t to test only the first controller',
 required_args = parser.add_argument_group('required named arguments')
 parser.add_argument('--brief', help='Print Exceptions Only', required=False, action='store_true')
 parser.add_argument('--debug', help='Print All Output, this the DEFAULT setting', required=False, action='store_true')
+parser.add_argument('--log-format', help='text (default) or json, one json object per line', required=False, choices=['text', 'json'])
 parser.add_argument('-n', '--namespace', help='Prints Graphite Namespace for Troubleshooting Purposes', action='store_true')
+parser.add_argument('-w', '--workers', help='Maximum number of concurrent API workers, default 16', required=False, type=int)
+parser.add_argument('-r', '--report-dir', help='Directory to write a JSON report of every controller cycle to', required=False)
+parser.add_argument('-p', '--prometheus-port', help='Serve the metrics to Prometheus on this port instead of running once, metrics are still sent to graphite if it is configured', required=False, type=int)
 args = parser.parse_args()
 
 
@@ -55,56 +93,1237 @@ args = parser.parse_args()
 
 
 
-#----- Setting print levels
+#----- Logging, every message goes through a LoggerAdapter that adds its
+#----- source, the controller or GRAPHITE, SCHEDULER and AVI_SCRIPT.  Records
+#----- are put on a queue and written by a background thread so collectors
+#----- never wait on stdout, messages are only formatted when their level is
+#----- enabled and then by the writer thread.  Only the arguments of a record
+#----- are kept, they must not be changed after the call.  --brief only logs
+#----- warnings and errors.
+#----- Warnings and errors logged during a controller cycle are counted per
+#----- collector and message, only the first is written and the number of
+#----- repeats is logged once the cycle has finished.
+class log_formatter(logging.Formatter):
+    def __init__(self, structured=False):
+        logging.Formatter.__init__(self)
+        self.structured = structured
+
+
+    def format(self, record):
+        source = getattr(record, 'source', 'AVI_SCRIPT')
+        message = record.getMessage()
+        if self.structured == True:
+            entry = {
+                'time': datetime.fromtimestamp(record.created).isoformat(),
+                'level': record.levelname,
+                'source': source,
+                'collector': getattr(record, 'collector', None),
+                'message': message}
+            if record.exc_text:
+                entry['exception'] = record.exc_text
+            return json.dumps(entry)
+        text = str(datetime.fromtimestamp(record.created))+' '+source+': '+message
+        if record.exc_text:
+            text = text+'\n'+record.exc_text
+        return text
+
+
+
+class queue_log_handler(logging.Handler):
+    def __init__(self, target, max_queue=10000):
+        logging.Handler.__init__(self)
+        self.target = target
+        self.queue = Queue.Queue(max_queue)
+        self.dropped = 0
+        t = threading.Thread(target=self._write_loop)
+        t.daemon = True
+        t.start()
+
+
+    #----- tracebacks are formatted by the caller, they refer to its frames
+    def emit(self, record):
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip('\n')
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+
+    def _write_loop(self):
+        while True:
+            record = self.queue.get()
+            try:
+                self.target.handle(record)
+                if self.dropped > 0:
+                    dropped = self.dropped
+                    self.dropped = 0
+                    self.target.handle(logging.makeLogRecord({'msg': 'log queue was full, %d messages were dropped', 'args': (dropped,), 'levelno': logging.WARNING, 'levelname': 'WARNING'}))
+            except:
+                pass
+            finally:
+                self.queue.task_done()
+
+
+    #----- waits until every queued record has been written
+    def flush(self):
+        self.queue.join()
+        self.target.flush()
+
+
+
+class cycle_log_filter(logging.Filter):
+    def filter(self, record):
+        record.collector = getattr(task_context, 'collector', None)
+        stats = getattr(task_context, 'stats', None)
+        if stats == None or record.levelno < logging.WARNING:
+            return True
+        return stats.first_log(record.collector, record.msg)
+
+
+
+def source_log(source):
+    return logging.LoggerAdapter(logger, {'source': source})
+
+
+logger = logging.getLogger('avi_metrics')
+logger.propagate = False
 if args.brief == True:
-    args.debug = False
+    logger.setLevel(logging.WARNING)
 else:
-    args.debug = True
+    logger.setLevel(logging.INFO)
+log_output = logging.StreamHandler(sys.stdout)
+log_output.setFormatter(log_formatter((args.log_format or os.environ.get('EN_LOG_FORMAT')) == 'json'))
+log_handler = queue_log_handler(log_output)
+log_handler.addFilter(cycle_log_filter())
+logger.addHandler(log_handler)
+atexit.register(log_handler.flush)
+script_log = source_log('AVI_SCRIPT')
+
+
+
+
+
+
+
+#----- A single metric sample, collectors append these to their send list.
+#----- A namedtuple keeps each sample to three slots instead of building a
+#----- throwaway class for every metric.
+graphite_sample = namedtuple('graphite_sample', ['name_space', 'value', 'timestamp'])
+
+
+
+#----- Graphite sender, all collectors send their samples through a single
+#----- instance of this class.  Collectors only add samples to the buffer, a
+#----- background thread sends them when batch_size samples are pending or
+#----- flush_interval seconds have passed, so collection never waits on
+#----- carbon.  The connection to carbon is kept open between sends and
+#----- re-established if it drops.
+#----- Samples are graphite_sample tuples of name_space, value and timestamp
+#----- protocol is either plaintext, one line per sample, or pickle, batches of
+#----- up to batch_size samples sent as a single length prefixed pickle
+#----- which carbon relays unpack much more cheaply.  The pickle listener of
+#----- carbon is usually on port 2004.
+#----- While carbon can not be reached samples are kept in memory, once more
+#----- than max_buffer are waiting the oldest are appended to spool_file.  The
+#----- spool is replayed with the original timestamps after carbon is back,
+#----- at most replay_rate samples per second.
+class graphite_sender():
+    def __init__(self, server, port, batch_size=500, flush_interval=5, timeout=10, protocol='plaintext', spool_file=None, max_buffer=100000, replay_rate=5000):
+        self.log = source_log('GRAPHITE')
+        if protocol not in ('plaintext', 'pickle'):
+            raise ValueError('unknown graphite protocol: '+str(protocol))
+        self.server = server
+        self.port = port
+        self.protocol = protocol
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.spool_file = spool_file
+        self.max_buffer = max_buffer
+        self.replay_rate = replay_rate
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.spool_lock = threading.Lock()
+        self.pending = threading.Event()
+        self.sock = None
+        self.buffer = []
+        self.retry_time = 0
+        self.spool_offset = 0
+        self.last_replay = time.time()
+        self.flusher = None
+
+
+    def _connect(self):
+        sock = socket.create_connection((self.server, self.port), self.timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+
+
+    def _disconnect(self):
+        if self.sock != None:
+            try:
+                self.sock.close()
+            except:
+                pass
+        self.sock = None
+
+
+    #----- background thread, sends the buffer when it is full or every
+    #----- flush_interval seconds
+    def _flush_loop(self):
+        while True:
+            self.pending.wait(self.flush_interval)
+            self.pending.clear()
+            try:
+                self._drain()
+            except:
+                self.log.exception('flush to %s failed', self.server)
+
+
+    def _start_flusher(self):
+        with self.lock:
+            if self.flusher == None:
+                self.flusher = threading.Thread(target = self._flush_loop)
+                self.flusher.daemon = True
+                self.flusher.start()
 
 
+    #----- floats are written as is so fractional values are not truncated
+    def _format_value(self, value):
+        if isinstance(value, float):
+            return repr(value)
+        return '%d' % value
 
 
+    #----- samples are converted when they are buffered so a bad value fails
+    #----- the collector that sent it instead of the whole batch
+    def _encode_sample(self, entry):
+        if self.protocol == 'pickle':
+            return (entry.name_space, (int(entry.timestamp), float(entry.value)))
+        return '%s %s %d\n' % (entry.name_space, self._format_value(entry.value), entry.timestamp)
 
 
+    def _encode(self, samples):
+        if self.protocol == 'pickle':
+            payload = []
+            for i in range(0, len(samples), self.batch_size):
+                data = pickle.dumps(samples[i:i+self.batch_size], 2)
+                payload.append(struct.pack('!L', len(data)) + data)
+            return b''.join(payload)
+        return ''.join(samples).encode('utf-8')
 
-#----- Send value to graphite
-def send_value_graphite(name, value, timestamp):
-    if args.namespace == True:
-        print '=====> NAMESPACE:  '+name
-    socket.setdefaulttimeout(10)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((graphite_server, graphite_port))
-    sock.send('%s %d %d\n' % (name, value, timestamp))
-    sock.close()
 
+    def _write(self, samples):
+        payload = self._encode(samples)
+        #----- retry once on a fresh connection if the current one has dropped
+        for attempt in range(2):
+            try:
+                if self.sock == None:
+                    self._connect()
+                self.sock.sendall(payload)
+                return
+            except socket.error:
+                self._disconnect()
+                if attempt == 1:
+                    raise
+
+
+    #----- the spool always holds plaintext lines, pickle samples are
+    #----- converted when they are written and read back
+    def _spool_line(self, sample):
+        if self.protocol == 'pickle':
+            return '%s %s %d\n' % (sample[0], self._format_value(sample[1][1]), sample[1][0])
+        return sample
+
+
+    def _from_spool_line(self, line):
+        if self.protocol == 'pickle':
+            name, value, timestamp = line.split()
+            return (name, (int(timestamp), float(value)))
+        return line
+
+
+    def _spool(self, samples):
+        if self.spool_file == None:
+            self.log.error('%s is unreachable and no spool file is set, dropping %d metrics', self.server, len(samples))
+            return
+        with self.spool_lock:
+            with open(self.spool_file, 'ab') as spool:
+                spool.write(''.join([self._spool_line(sample) for sample in samples]).encode('utf-8'))
+
+
+    #----- moves the oldest samples over max_buffer to the spool, must be
+    #----- called with self.lock held, the spool is written after it is released
+    def _overflow(self):
+        overflow = len(self.buffer) - self.max_buffer
+        if overflow <= 0:
+            return []
+        spill = self.buffer[:overflow]
+        self.buffer = self.buffer[overflow:]
+        return spill
+
+
+    #----- puts samples that could not be sent back in front of the buffer
+    def _requeue(self, samples):
+        with self.lock:
+            self.buffer = samples + self.buffer
+            spill = self._overflow()
+        if len(spill) > 0:
+            self._spool(spill)
+
+
+    #----- sends the next part of the spool, replay_rate limits how many
+    #----- samples are sent per second of time passed since the last replay
+    def _replay(self):
+        now = time.time()
+        if self.spool_file == None or os.path.exists(self.spool_file) == False:
+            self.last_replay = now
+            return
+        budget = int(min(now - self.last_replay, self.flush_interval) * self.replay_rate)
+        if budget < 1:
+            return
+        lines = []
+        with self.spool_lock:
+            with open(self.spool_file, 'rb') as spool:
+                spool.seek(self.spool_offset)
+                while len(lines) < budget:
+                    line = spool.readline()
+                    if not line:
+                        break
+                    lines.append(line.decode('utf-8'))
+                offset = spool.tell()
+            if len(lines) == 0:
+                os.remove(self.spool_file)
+                self.spool_offset = 0
+                return
+        samples = []
+        for line in lines:
+            try:
+                samples.append(self._from_spool_line(line))
+            except ValueError:
+                pass
+        self._write(samples)
+        self.spool_offset = offset
+        self.last_replay = now
+
+
+    #----- drops the part of the spool that has already been replayed so the
+    #----- next run carries on where this one stopped
+    def _compact_spool(self):
+        with self.spool_lock:
+            if self.spool_offset == 0 or os.path.exists(self.spool_file) == False:
+                return
+            temp_file = self.spool_file + '.' + str(os.getpid())
+            with open(self.spool_file, 'rb') as spool:
+                spool.seek(self.spool_offset)
+                with open(temp_file, 'wb') as temp:
+                    while True:
+                        data = spool.read(65536)
+                        if not data:
+                            break
+                        temp.write(data)
+            os.rename(temp_file, self.spool_file)
+            self.spool_offset = 0
+
+
+    def _drain(self):
+        with self.lock:
+            samples = self.buffer
+            self.buffer = []
+        with self.write_lock:
+            #----- carbon failed recently, keep the samples instead of waiting
+            #----- on another connect timeout
+            if time.time() < self.retry_time:
+                self._requeue(samples)
+                return
+            try:
+                if len(samples) > 0:
+                    self._write(samples)
+                    samples = []
+                self._replay()
+            except socket.error:
+                self.log.warning('unable to send to %s, metrics are kept until it can be reached', self.server)
+                self.retry_time = time.time() + self.flush_interval
+                self._requeue(samples)
+
+
+    def send(self, name, value, timestamp):
+        self.send_list([graphite_sample(name, value, timestamp)])
+
+
+    def send_list(self, class_list):
+        stats = getattr(task_context, 'stats', None)
+        if stats != None:
+            stats.record_samples(len(class_list))
+        with self.lock:
+            for entry in class_list:
+                if args.namespace == True:
+                    print('=====> NAMESPACE:  '+entry.name_space)
+                self.buffer.append(self._encode_sample(entry))
+            full = len(self.buffer) >= self.batch_size
+            spill = self._overflow()
+        if len(spill) > 0:
+            self._spool(spill)
+        self._start_flusher()
+        if full == True:
+            self.pending.set()
+
+
+    #----- asks the background thread to send what is buffered, does not wait
+    def flush(self):
+        self._start_flusher()
+        self.pending.set()
+
+
+    #----- sends what is buffered before the script exits, samples that can not
+    #----- be sent are spooled for the next run
+    def close(self):
+        self._drain()
+        with self.lock:
+            samples = self.buffer
+            self.buffer = []
+        with self.write_lock:
+            if len(samples) > 0:
+                self._spool(samples)
+            self._compact_spool()
+            self._disconnect()
+
+
+
+
+#----- Prometheus exporter, used in place of the graphite sender when the
+#----- script runs with a prometheus port.  Collectors send their samples the
+#----- same way, the exporter keeps the last value of every series in memory
+#----- and serves them on /metrics, a scrape never calls the controller.
+#----- Samples of a collector are staged while it runs and replace that
+#----- collector's series once the controller cycle has finished, series of
+#----- objects that are gone disappear with the next run of their collector.
+#----- The page is rendered once per cycle so any number of scrapers can be
+#----- served from it.  With a graphite sender as forward every sample is also
+#----- sent to graphite.
+#----- Graphite namespaces are turned into labeled series with
+#----- prometheus_rules, see prometheus_exporter.describe.
+prometheus_rules = [
+    ('serviceengine', '$serviceengine', 'virtualservice_stats', '$virtualservice', '*'),
+    ('serviceengine', '$serviceengine', 'bgp-peer', '$peer'),
+    ('serviceengine', '$serviceengine', '*'),
+    ('virtualservice', '$virtualservice', 'pool', '$pool', '$server', '*'),
+    ('virtualservice', '$virtualservice', 'pool', '$pool', '*'),
+    ('virtualservice', '$virtualservice', 'serviceengine', '$serviceengine'),
+    ('virtualservice', '$virtualservice', 'pool_member_sig_logs', '$pool_member'),
+    ('virtualservice', '$virtualservice', '*'),
+    ('virtualmachine', '$serviceengine', '*'),
+    ('cluster', '$member', '*'),
+    ('vcenter', '$vcenter', '*'),
+    ('apic', '$apic', '*'),
+    ('networks', '$network', '*'),
+    ('sslcerts', '$cert', '*'),
+    ('esx', '$esx_host', '*'),
+    ('licensing', 'expiration_days', '$license'),
+    ('current_version', '$version'),
+    ('metricscript', 'collectors', '$collector', 'api_latency', '$bucket'),
+    ('metricscript', 'collectors', '$collector', '*')]
+prometheus_invalid_chars = re.compile('[^a-zA-Z0-9_:]')
+
+class prometheus_exporter():
+    def __init__(self, port, forward=None, address=''):
+        self.forward = forward
+        self.lock = threading.Lock()
+        #----- namespace -> (family, labels), filled in by avi_metrics.namespace.
+        #----- When it grows too large it becomes old_descriptions and starts
+        #----- empty, namespaces still in use are moved back on their next use
+        self.descriptions = {}
+        self.old_descriptions = {}
+        #----- cycle_stats -> {collector: {(family, labels): value}}
+        self.staging = {}
+        #----- (metric_prefix, collector) -> {(family, labels): value}
+        self.snapshot = {}
+        self.page = b''
+        self.page_gzip = None
+        exporter = self
+        class metrics_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def log_message(self, *log_args):
+                pass
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                gzip = 'gzip' in (self.headers.get('Accept-Encoding') or '')
+                body = exporter.render(gzip)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                if gzip == True:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        class metrics_server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+            daemon_threads = True
+        self.server = metrics_server((address, port), metrics_handler)
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+
+    def _label_value(self, value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+    #----- Works out the family and labels of a namespace from the parts it
+    #----- was built from.  The first rule whose literal parts match names the
+    #----- family after its literal parts and the parts matched by *, the
+    #----- $ parts become labels.  Namespaces no rule matches get a family
+    #----- named after all their parts.
+    def describe(self, name_space, avi_metrics_obj, parts):
+        if name_space in self.descriptions:
+            return
+        if name_space in self.old_descriptions:
+            self.descriptions[name_space] = self.old_descriptions[name_space]
+            return
+        labels = [('controller', avi_metrics_obj.avi_controller), ('location', avi_metrics_obj.host_location), ('environment', avi_metrics_obj.host_environment)]
+        family = ['avi'] + list(parts)
+        for rule in prometheus_rules:
+            if rule[-1] == '*':
+                if len(parts) < len(rule):
+                    continue
+            elif len(parts) != len(rule):
+                continue
+            rule_family = ['avi']
+            rule_labels = []
+            for token, part in zip(rule, parts):
+                if token == '*':
+                    break
+                if token.startswith('$'):
+                    rule_labels.append((token[1:], part))
+                elif token == part:
+                    rule_family.append(part)
+                else:
+                    rule_family = None
+                    break
+            if rule_family != None:
+                if rule[-1] == '*':
+                    rule_family.extend(parts[len(rule) - 1:])
+                family = rule_family
+                labels.extend(rule_labels)
+                break
+        family = prometheus_invalid_chars.sub('_', '_'.join(family))
+        labels = ','.join('%s="%s"' %(k, self._label_value(v)) for k, v in labels)
+        self.descriptions[name_space] = (family, labels)
+
+
+    def send(self, name, value, timestamp):
+        self.send_list([graphite_sample(name, value, timestamp)])
+
+
+    def send_list(self, class_list):
+        if self.forward != None:
+            self.forward.send_list(class_list)
+        stats = getattr(task_context, 'stats', None)
+        if stats == None:
+            return
+        if self.forward == None:
+            stats.record_samples(len(class_list))
+        collector = getattr(task_context, 'collector', None) or 'gather_metrics'
+        series = {}
+        for entry in class_list:
+            if args.namespace == True and self.forward == None:
+                print('=====> NAMESPACE:  '+entry.name_space)
+            try:
+                value = float(entry.value)
+            except (TypeError, ValueError):
+                continue
+            description = self.descriptions.get(entry.name_space) or self.old_descriptions.get(entry.name_space)
+            if description == None:
+                description = (prometheus_invalid_chars.sub('_', entry.name_space), '')
+            series[description] = value
+        with self.lock:
+            self.staging.setdefault(stats, {}).setdefault(collector, {}).update(series)
+
+
+    #----- Replaces the series of every collector that ran in the cycle of
+    #----- stats with what it sent and renders the page again
+    def publish(self, metric_prefix, stats):
+        with stats.lock:
+            collectors = list(stats.collectors.keys())
+        with self.lock:
+            staged = self.staging.pop(stats, {})
+            for name in collectors:
+                self.snapshot[(metric_prefix, name)] = staged.get(name, {})
+            self._render_page()
+
+
+    #----- Drops the series of controllers that are no longer configured
+    def retain(self, metric_prefixes):
+        with self.lock:
+            for key in list(self.snapshot.keys()):
+                if key[0] not in metric_prefixes:
+                    del self.snapshot[key]
+            self._render_page()
+
+
+    #----- must be called with self.lock held
+    def _render_page(self):
+        families = {}
+        for series in self.snapshot.values():
+            for (family, labels), value in series.items():
+                families.setdefault(family, []).append('%s{%s} %s\n' %(family, labels, repr(value)))
+        lines = []
+        for family in sorted(families.keys()):
+            lines.append('# TYPE %s gauge\n' %family)
+            lines.extend(families[family])
+        self.page = ''.join(lines).encode('utf-8')
+        self.page_gzip = None
+        if len(self.descriptions) > 2 * sum(len(s) for s in self.snapshot.values()) + 10000:
+            self.old_descriptions = self.descriptions
+            self.descriptions = {}
+
+
+    def render(self, gzip=False):
+        with self.lock:
+            if gzip == False:
+                return self.page
+            if self.page_gzip == None:
+                compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                self.page_gzip = compressor.compress(self.page) + compressor.flush()
+            return self.page_gzip
+
+
+    def flush(self):
+        if self.forward != None:
+            self.forward.flush()
+
+
+    def close(self):
+        if self.forward != None:
+            self.forward.close()
+
+
+
+
+#----- Self instrumentation, for every controller cycle the wall time, api
+#----- calls, response bytes, api errors, api latency histogram, samples sent
+#----- and errors of each collector are counted.  task_context holds the
+#----- cycle_stats and collector a thread is working for, the task scheduler
+#----- hands it on to the threads that run a collector's fan out.
+task_context = threading.local()
+latency_buckets = [50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class cycle_stats():
+    def __init__(self):
+        self.start_time = time.time()
+        self.lock = threading.Lock()
+        self.collectors = {}
+        self.log_counts = {}
+
+
+    #----- must be called with self.lock held
+    def _collector(self):
+        name = getattr(task_context, 'collector', None) or 'gather_metrics'
+        if name not in self.collectors:
+            self.collectors[name] = {
+                'wall_time': 0.0,
+                'api_calls': 0,
+                'api_errors': 0,
+                'response_bytes': 0,
+                'samples': 0,
+                'errors': 0,
+                'api_latency': [0] * (len(latency_buckets) + 1)}
+        return self.collectors[name]
+
+
+    def record_request(self, seconds, response_bytes, failed):
+        bucket = bisect.bisect_left(latency_buckets, seconds * 1000)
+        with self.lock:
+            c = self._collector()
+            c['api_calls'] += 1
+            c['response_bytes'] += response_bytes
+            c['api_latency'][bucket] += 1
+            if failed == True:
+                c['api_errors'] += 1
+
+
+    def record_samples(self, count):
+        with self.lock:
+            self._collector()['samples'] += count
+
+
+    def record_error(self):
+        with self.lock:
+            self._collector()['errors'] += 1
+
+
+    #----- True for the first warning or error with this message from a
+    #----- collector in the cycle, the repeats are only counted
+    def first_log(self, collector, message):
+        key = (collector, message)
+        with self.lock:
+            self.log_counts[key] = self.log_counts.get(key, 0) + 1
+            return self.log_counts[key] == 1
+
+
+    def repeated_logs(self):
+        with self.lock:
+            return [(collector, message, count - 1) for (collector, message), count in self.log_counts.items() if count > 1]
+
+
+    #----- runs a collector with its work attributed to it, wall_time is in
+    #----- milliseconds like metricscript.executiontime
+    def run(self, name, func):
+        previous = (getattr(task_context, 'stats', None), getattr(task_context, 'collector', None))
+        task_context.stats = self
+        task_context.collector = name
+        start_time = time.time()
+        try:
+            return func()
+        finally:
+            with self.lock:
+                self._collector()['wall_time'] += (time.time() - start_time) * 1000
+            task_context.stats, task_context.collector = previous
+
+
+
+
+#----- Task scheduler, every unit of concurrent work (controllers, collectors
+#----- and the per tenant/se/vs fan-out inside collectors) runs on one shared
+#----- pool of threads so the number of workers is bounded no matter how many
+#----- objects are being polled.
+#----- map() can be called from inside a task that is already running on the
+#----- pool.  The calling thread works through its own items alongside the
+#----- pool threads and only waits on items that have already been started,
+#----- so nested calls can not deadlock the pool.
+class task_scheduler():
+    def __init__(self, max_workers):
+        self.log = source_log('SCHEDULER')
+        self.max_workers = max_workers
+        self.pool = None
+        self.lock = threading.Lock()
+
+
+    def _get_pool(self):
+        with self.lock:
+            if self.pool == None:
+                self.pool = ThreadPool(self.max_workers)
+            return self.pool
+
+
+    def map(self, func, items):
+        items = list(items)
+        results = [None] * len(items)
+        if len(items) == 0:
+            return results
+        work = Queue.Queue()
+        for i, item in enumerate(items):
+            work.put((i, item))
+        state = {'completed': 0}
+        done = threading.Condition()
+        context = (getattr(task_context, 'stats', None), getattr(task_context, 'collector', None))
+        def drain():
+            while True:
+                try:
+                    i, item = work.get_nowait()
+                except Queue.Empty:
+                    return
+                previous = (getattr(task_context, 'stats', None), getattr(task_context, 'collector', None))
+                task_context.stats, task_context.collector = context
+                try:
+                    results[i] = func(item)
+                except:
+                    self.log.exception('task failed')
+                finally:
+                    task_context.stats, task_context.collector = previous
+                    with done:
+                        state['completed'] += 1
+                        done.notify_all()
+        pool = self._get_pool()
+        for n in range(min(len(items) - 1, self.max_workers)):
+            pool.apply_async(drain)
+        drain()
+        with done:
+            while state['completed'] < len(items):
+                done.wait(1)
+        return results
+
+
+    #----- Ordered, streaming version of map().  Results are yielded in the
+    #----- order of items as soon as they are available while at most window
+    #----- items are run ahead of the consumer.  As with map() the consumer
+    #----- runs any item no pool thread has picked up yet itself.
+    def imap(self, func, items, window=4):
+        items = list(items)
+        state = {'next': 0, 'yielded': 0}
+        results = {}
+        done = threading.Condition()
+        context = (getattr(task_context, 'stats', None), getattr(task_context, 'collector', None))
+        def run(i):
+            previous = (getattr(task_context, 'stats', None), getattr(task_context, 'collector', None))
+            task_context.stats, task_context.collector = context
+            try:
+                result = (True, func(items[i]))
+            except Exception as e:
+                result = (False, e)
+            finally:
+                task_context.stats, task_context.collector = previous
+            with done:
+                results[i] = result
+                done.notify_all()
+        def prefetch():
+            while True:
+                with done:
+                    i = state['next']
+                    if i >= len(items) or i >= state['yielded'] + window:
+                        return
+                    state['next'] += 1
+                run(i)
+        pool = self._get_pool()
+        for n in range(min(window, len(items)) - 1):
+            pool.apply_async(prefetch)
+        for i in range(len(items)):
+            with done:
+                claimed = state['next'] > i
+                if claimed == False:
+                    state['next'] = i + 1
+            if claimed == False:
+                run(i)
+            with done:
+                while i not in results:
+                    done.wait(1)
+                ok, value = results.pop(i)
+                state['yielded'] = i + 1
+            if state['next'] < len(items):
+                pool.apply_async(prefetch)
+            if ok == False:
+                raise value
+            yield value
+
+
+
+
+#----- Login session cache, the session and csrf cookies returned by a login
+#----- are kept on disk so the next run of the script can reuse them instead
+#----- of logging in again.  The file is only readable by the script's user.
+#----- A second file of the same format keeps the leader of every cluster.
+class avi_session_cache():
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+
+
+    def _read(self):
+        try:
+            with open(self.cache_file) as cf:
+                return json.load(cf)
+        except:
+            return {}
+
+
+    def load(self, avi_controller, avi_user):
+        if self.cache_file == None:
+            return None
+        with self.lock:
+            return self._read().get(avi_controller+'|'+avi_user)
+
+
+    def save(self, avi_controller, avi_user, session):
+        if self.cache_file == None:
+            return
+        with self.lock:
+            sessions = self._read()
+            sessions[avi_controller+'|'+avi_user] = session
+            temp_file = self.cache_file+'.'+str(os.getpid())
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as cf:
+                json.dump(sessions, cf)
+            os.rename(temp_file, self.cache_file)
+
+
+
+
+#----- Reverse DNS names of cluster members, vcenters and apics.  Lookups run
+#----- in background threads, only the first lookup of an address is waited
+#----- for, at most wait seconds, so the metric name of an address normally
+#----- does not change from its address to its name a cycle later while an
+#----- unresponsive resolver does not stall the collector.  A known name is
+#----- returned right away and looked up again in the background once it is
+#----- older than ttl, addresses that have no name are remembered for
+#----- negative_ttl.  The names are kept in cache_file between runs when one
+#----- is set, names that are due are looked up again as soon as the cache is
+#----- loaded.
+class reverse_dns_cache():
+    def __init__(self, cache_file=None, ttl=3600, negative_ttl=300, wait=5):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        #----- address -> {'name': host name or None, 'time': time of the lookup}
+        self.entries = {}
+        #----- address -> event set when its running lookup finishes
+        self.pending = {}
+        if cache_file != None:
+            try:
+                with open(cache_file) as cf:
+                    self.entries = json.load(cf)
+            except:
+                pass
+        self.prewarm(list(self.entries.keys()))
 
-#----- This function is used to loop through a list of Classes and send to
-#----- graphite.  Intent is single socket creation and close
-#----- Classes in list require 3 attributes:
-#-----    1.  name_space
-#-----    2.  value
-#-----    3.  timestamp
-def send_class_list_graphite(class_list):
-    socket.setdefaulttimeout(10)
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((graphite_server, graphite_port))
-    for entry in class_list:
-        if args.namespace == True:
-            print '=====> NAMESPACE:  '+entry.name_space
-        sock.send('%s %d %d\n' % (entry.name_space, entry.value, entry.timestamp))
-    sock.close()
+
+    def _due(self, entry):
+        if entry['name'] == None:
+            return time.time() - entry['time'] >= self.negative_ttl
+        return time.time() - entry['time'] >= self.ttl
+
+
+    #----- starts a lookup unless one is already running for the address,
+    #----- returns the event of the running lookup
+    def _refresh(self, address):
+        with self.lock:
+            if address in self.pending:
+                return self.pending[address]
+            done = threading.Event()
+            self.pending[address] = done
+        lookup = threading.Thread(target=self._lookup, args=(address, done))
+        lookup.daemon = True
+        lookup.start()
+        return done
+
+
+    def _lookup(self, address, done):
+        try:
+            name = socket.gethostbyaddr(address)[0]
+        except:
+            name = None
+        with self.lock:
+            self.entries[address] = {'name': name, 'time': time.time()}
+            del self.pending[address]
+        done.set()
+        self._save()
+
+
+    def _save(self):
+        if self.cache_file == None:
+            return
+        with self.save_lock:
+            with self.lock:
+                data = json.dumps(self.entries)
+            try:
+                temp_file = self.cache_file+'.'+str(os.getpid())
+                with open(temp_file, 'w') as cf:
+                    cf.write(data)
+                os.rename(temp_file, self.cache_file)
+            except (IOError, OSError):
+                script_log.exception('unable to write the dns cache')
+
+
+    #----- starts the lookup of every address that is not known or is due
+    def prewarm(self, addresses):
+        for address in addresses:
+            with self.lock:
+                entry = self.entries.get(address)
+            if entry == None or self._due(entry):
+                self._refresh(address)
+
+
+    #----- Returns the host name of address, None when it has none or when
+    #----- the first lookup of the address takes longer than wait seconds.  The
+    #----- lookup then keeps running and its result is used from the next
+    #----- cycle on.
+    def hostname(self, address):
+        with self.lock:
+            entry = self.entries.get(address)
+        if entry == None:
+            self._refresh(address).wait(self.wait)
+            with self.lock:
+                entry = self.entries.get(address)
+            if entry == None:
+                return None
+        elif self._due(entry):
+            self._refresh(address)
+        return entry['name']
+
+
+
+
+#----- Collector schedule, every controller runs a metric cycle each
+#----- cycle_interval seconds.  Collectors listed in collector_intervals only
+#----- run on the cycle that starts their own interval, collectors that are
+#----- not listed run every cycle.  A slot that was missed because a cycle ran
+#----- late is run once on the next cycle instead of being made up for.
+cycle_interval = 60
+collector_intervals = {
+    'vcenter_monitor_counters': 300,
+    'pool_member_sig_logs_threaded': 300,
+    'expiring_certs': 3600,
+    'license_expiration': 3600}
+
+#----- Concurrent per vs logs queries when a controller can not group logs
+sig_log_workers = 4
+
+
+
+
+#----- Controller inventory cache, object collections are fetched from the
+#----- controller once per tenant and shared by every collector.  Collections
+#----- are dropped at the start of each metric cycle unless they are listed in
+#----- inventory_ttl, config objects that rarely change are kept for longer.
+inventory_ttl = {
+    'cloud': 900,
+    'serviceenginegroup': 900,
+    'sslkeyandcertificate': 3600,
+    'vimgrclusterruntime': 300,
+    'vimgrhostruntime': 300,
+    'vimgrvmruntime': 300}
+
+
+class avi_inventory():
+    def __init__(self, avi_metrics_obj):
+        self.avi = avi_metrics_obj
+        self.cache = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+
+    #----- called by gather_metrics at the start of every cycle
+    def new_cycle(self):
+        now = time.time()
+        with self.lock:
+            for key in list(self.cache.keys()):
+                fetched, results = self.cache[key]
+                if now - fetched >= inventory_ttl.get(key[0].split('?',1)[0], 0):
+                    del self.cache[key]
+
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+
+    #----- returns the results list for an object collection, collection can
+    #----- include query parameters, ie: virtualservice-inventory?include=health_score
+    def get(self, collection, tenant):
+        key = (collection, tenant)
+        #----- concurrent collectors asking for the same collection wait on
+        #----- the first request instead of sending their own
+        with self._key_lock(key):
+            if key not in self.cache:
+                results = list(self.avi.avi_paginate(collection,tenant))
+                self.cache[key] = (time.time(), results)
+            return self.cache[key][1]
+
+
+    #----- uuid to name map for a collection, if tenant is not provided the
+    #----- map covers all tenants
+    def uuid_names(self, collection, tenant=None):
+        if tenant != None:
+            tenant_list = [tenant]
+        else:
+            tenant_list = [t['name'] for t in self.avi.tenants]
+        names = {}
+        for t in tenant_list:
+            for o in self.get(collection, t):
+                names[o['uuid']] = o['name']
+        return names
+
+
+
+
+#----- ESX topology index, the vCenter cluster, host and vm runtime
+#----- collections are loaded in bulk through the inventory and indexed by
+#----- uuid, name, host_ref and vm_refs.  The collections are refreshed on the
+#----- slower inventory_ttl interval and each index is only rebuilt when its
+#----- collection was fetched again.
+def ref_uuid(ref):
+    return ref.split('#',1)[0].rstrip('/').rsplit('/',1)[1]
+
+
+class esx_topology():
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+
+    def _index(self, collection):
+        results = self.inventory.get(collection,'admin')
+        with self.lock:
+            if collection not in self.indexes or self.indexes[collection][0] is not results:
+                index = {'uuid': {}, 'name': {}, 'host_ref': {}, 'vm_refs': {}}
+                for o in results:
+                    index['uuid'][o['uuid']] = o
+                    index['name'][o['name']] = o
+                    if 'host_ref' in o:
+                        index['host_ref'].setdefault(ref_uuid(o['host_ref']), []).append(o)
+                    for v in o.get('vm_refs', []):
+                        index['vm_refs'][ref_uuid(v)] = o
+                self.indexes[collection] = (results, index)
+            return self.indexes[collection][1]
+
+
+    #----- by is uuid, name, host_ref or vm_refs, refs can be passed as is
+    def find(self, collection, value, by='uuid'):
+        if by != 'name' and '/' in value:
+            value = ref_uuid(value)
+        return self._index(collection)[by].get(value)
+
+
+    #----- objects added since their collection was fetched are not indexed
+    #----- yet, they are fetched on their own.  Returns None if the controller
+    #----- does not know the object either.
+    def get(self, collection, ref):
+        o = self.find(collection, ref)
+        if o == None:
+            resp = self.inventory.avi.avi_request('%s/%s' %(collection, ref_uuid(ref)),'admin')
+            if resp.status_code == 200:
+                o = self.inventory.avi.avi_json(resp)
+        return o
+
+
+    def cluster(self, ref):
+        return self.get('vimgrclusterruntime', ref)
+
+
+    def host(self, ref):
+        return self.get('vimgrhostruntime', ref)
+
+
+    #----- esx host a vm runs on, from the vm_refs of the hosts or the
+    #----- host_ref of the vm
+    def vm_host(self, vm):
+        host = self.find('vimgrhostruntime', vm['uuid'], by='vm_refs')
+        if host == None and 'host_ref' in vm:
+            host = self.host(vm['host_ref'])
+        return host
+
+
+
+
+#----- Analytics query planner, collectors register the metric requests they
+#----- need for a tenant at the start of the cycle.  The first collector that
+#----- asks for its series sends every pending request of that tenant in a
+#----- single analytics/metrics/collection call and the series are handed back
+#----- to each collector by request id.  Requests registered after the
+#----- tenant was queried are sent together on the next get.
+metric_collection_url = 'analytics/metrics/collection?pad_missing_data=false'
+pool_server_params = '&dimension_limit=1000&include_name=true&include_refs=true'
+#----- vs/se pairs per page of the vs metrics by se query
+vs_se_page_size = 1000
+
+
+#----- The collectors only read the name and refs of a metric and its latest
+#----- value.  The series of a tenant are held until every collector has
+#----- read them, so the rest of the header (statistics, units,
+#----- descriptions) is dropped as soon as a response is decoded.
+def compact_series(series):
+    compact = []
+    for m in series:
+        header = m.get('header', {})
+        entry = {'header': dict((k, header[k]) for k in ('name', 'entity_ref', 'pool_ref') if k in header)}
+        if 'data' in m:
+            entry['data'] = m['data'][:1]
+        compact.append(entry)
+    return compact
+
+
+class avi_metric_queries():
+    def __init__(self, avi_metrics_obj):
+        self.avi = avi_metrics_obj
+        self.lock = threading.Lock()
+        self.new_cycle()
+
+
+    #----- called by gather_metrics at the start of every cycle
+    def new_cycle(self):
+        with self.lock:
+            self.pending = {}
+            self.series = {}
+            self.locks = {}
+
+
+    def _tenant_lock(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+
+    #----- request is a metric_requests entry without step and id, a copy is
+    #----- queued for every step.  params are extra url parameters, requests
+    #----- with different params are sent in separate calls.
+    def add(self, tenant, request_id, request, steps=(300,), params=''):
+        with self.lock:
+            pending = self.pending.setdefault((tenant, params), [])
+            for step in steps:
+                pending.append(dict(request, step=step, id='%s:%d' %(request_id, step)))
+
+
+    #----- returns the series of a request keyed by entity, when the request
+    #----- was queued for several steps the series of the later steps replace
+    #----- the earlier ones, ie: 1 min averages of vs with realtime stats
+    #----- enabled replace their 5 min averages
+    def get(self, tenant, request_id, steps=(300,), params=''):
+        key = (tenant, params)
+        with self._tenant_lock(key):
+            with self.lock:
+                metric_requests = self.pending.pop(key, [])
+            if len(metric_requests) > 0:
+                try:
+                    resp = self.avi.avi_json(self.avi.avi_post(metric_collection_url+params, tenant, {'metric_requests': metric_requests}))
+                except:
+                    #----- leave the requests queued so the next collector
+                    #----- retries them instead of getting empty series
+                    with self.lock:
+                        self.pending.setdefault(key, []).extend(metric_requests)
+                    raise
+                #----- series are compacted one request at a time so the
+                #----- full headers of only one request are held at once
+                for r_id in list(resp['series'].keys()):
+                    entities = resp['series'].pop(r_id)
+                    self.series[(key, r_id)] = dict((e, compact_series(entities[e])) for e in entities)
+                del resp
+            series = {}
+            for step in steps:
+                series.update(self.series.get((key, '%s:%d' %(request_id, step)), {}))
+            return series
 
 
 
 
 #----- This class is where all the test methods/functions exist and are executed
 class avi_metrics():
-    def __init__(self,avi_controller,host_location,host_environment, avi_user, avi_pass):
+    def __init__(self,avi_controller,host_location,host_environment, avi_user, avi_pass, pool_size=8, cluster=None):
         self.avi_controller = avi_controller
+        #----- members of the controller cluster, requests go to whichever
+        #----- member is the leader.  Without members avi_controller is the
+        #----- only endpoint.
+        self.cluster = cluster or []
+        self.endpoint = avi_controller
+        self.endpoint_time = 0
+        self.endpoint_lock = threading.Lock()
+        #----- cluster_status names the members by their host name
+        dns_cache.prewarm([m.split(':')[0] for m in [avi_controller] + self.cluster])
         self.host_location = host_location
         self.host_environment = host_environment
         self.avi_user = avi_user
         self.avi_pass = avi_pass
+        self.log = source_log(avi_controller)
+        self.metric_prefix = 'network-script.avi.'+host_location+'.'+host_environment+'.'+avi_controller.replace('.','_')
+        self.clean_names = {}
+        #----- cycles of each controller start at a fixed offset into the
+        #----- cycle so controllers do not all hit the api at the same second
+        self.start_offset = (zlib.crc32(avi_controller.encode('utf-8')) & 0xffffffff) % (cycle_jitter * 1000 + 1) / 1000.0
+        self.cycle_slot = None
+        self.cycle_lock = threading.Lock()
+        self.collector_slots = {}
+        self.http = self.avi_http_session(pool_size)
+        self.stats = cycle_stats()
+        self.session = None
+        self.session_lock = threading.Lock()
         vs_metric_list  = [
             'l4_server.avg_errored_connections',
             'l4_server.avg_rx_pkts',
@@ -209,22 +1428,292 @@ class avi_metrics():
             'se_stats.avg_packet_buffer_small_usage']
         #----
         self.se_metric_list = ','.join(se_metric_list)
+        pool_server_metric_list = [
+            'l4_server.max_rx_pkts_absolute',
+            'l4_server.avg_rx_pkts',
+            'l4_server.max_tx_pkts_absolute',
+            'l4_server.avg_tx_pkts',
+            'l4_server.max_rx_bytes_absolute',
+            'l4_server.max_tx_bytes_absolute',
+            'l4_server.avg_bandwidth',
+            'l7_server.avg_complete_responses',
+            'l4_server.avg_new_established_conns',
+            'l4_server.avg_pool_open_conns',
+            'l4_server.avg_pool_complete_conns',
+            'l4_server.avg_open_conns',
+            'l4_server.max_open_conns']
+        self.pool_server_metric_list = ','.join(pool_server_metric_list)
+        self.inventory = avi_inventory(self)
+        self.esx = esx_topology(self.inventory)
+        self.metric_queries = avi_metric_queries(self)
+
+
+    #----- Graphite namespace for this controller, metric_prefix is built once
+    #----- and the parts are appended to it.  The prometheus exporter is told
+    #----- the parts so it can label the series.
+    def namespace(self, *parts):
+        name_space = self.metric_prefix+'.'+'.'.join(parts)
+        if exporter != None:
+            exporter.describe(name_space, self, parts)
+        return name_space
+
+
+    #----- Object names with dots replaced, remembered for the rest of the
+    #----- cycle so the same name is only sanitized once
+    def clean_name(self, name):
+        clean = self.clean_names.get(name)
+        if clean == None:
+            clean = name.replace('.','_')
+            self.clean_names[name] = clean
+        return clean
+
+
+    #----- Host name of address for the metric namespace, the address itself
+    #----- when the name is not known
+    def host_name(self, address):
+        name = dns_cache.hostname(address)
+        if name == None:
+            return self.clean_name(address)
+        return name.replace('.','_')
+
+
+    #----- Returns True once per cycle_interval slot, a controller that falls
+    #----- behind runs the current slot and skips the ones it missed
+    def cycle_due(self, now):
+        slot = int((now - self.start_offset) // cycle_interval)
+        if slot == self.cycle_slot:
+            return False
+        self.cycle_slot = slot
+        return True
+
+
+    def next_cycle(self):
+        return (self.cycle_slot + 1) * cycle_interval + self.start_offset
+
+
+    #----- Returns True when a collector should run in the cycle started at
+    #----- now.  Without a previous run the collector runs straight away when
+    #----- the process is long running, cron runs only start it on the cycle
+    #----- its interval is aligned to.
+    def collector_due(self, name, now):
+        interval = collector_intervals.get(name, cycle_interval)
+        slot = int((now - self.start_offset) // interval)
+        if name in self.collector_slots:
+            due = slot != self.collector_slots[name]
+        else:
+            due = aligned_schedule == False or (now - self.start_offset) % interval < cycle_interval
+        if due == True:
+            self.collector_slots[name] = slot
+        return due
+
+
+    #----- All API calls to the controller share one requests session.  The
+    #----- session keeps up to pool_size keep-alive connections open, workers
+    #----- wait for a free connection instead of opening new ones so any number
+    #----- of concurrent requests are carried over pool_size TCP/TLS sessions.
+    def avi_http_session(self, pool_size):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        session.mount('https://', adapter)
+        return session
+
+
+    #----- every call to the controller goes through here so it is counted
+    #----- against the collector that made it.  A 401 is not counted as an
+    #----- error, it only means the session has to be renewed.
+    def avi_http(self, method, url, **kwargs):
+        start_time = time.time()
+        try:
+            resp = self.http.request(method, url, **kwargs)
+        except:
+            self.stats.record_request(time.time() - start_time, 0, True)
+            raise
+        self.stats.record_request(time.time() - start_time, len(resp.content), resp.status_code >= 400 and resp.status_code != 401)
+        return resp
 
 
     def avi_login(self):
-        login = requests.post('https://%s/login' %self.avi_controller, verify=False, data={'username': self.avi_user, 'password': self.avi_pass},timeout=15)
+        login = self.avi_http('POST', 'https://%s/login' %self.endpoint, verify=False, data={'username': self.avi_user, 'password': self.avi_pass},timeout=15)
         return login
 
 
+    #----- Returns the current login session, a session is reused across
+    #----- cycles and runs and a new login is only done if none is cached
+    def avi_session(self):
+        with self.session_lock:
+            if self.session == None:
+                self.session = session_cache.load(self.avi_controller, self.avi_user)
+            if self.session == None:
+                self._avi_relogin()
+            return self.session
+
+
+    #----- Called when the controller returns a 401.  Workers that hit the 401
+    #----- at the same time only trigger a single login, the others pick up
+    #----- the session it created.
+    def avi_relogin(self, expired_session):
+        with self.session_lock:
+            if self.session is expired_session:
+                self._avi_relogin()
+            return self.session
+
+
+    def _avi_relogin(self):
+        login = self.avi_failover(self.avi_login)
+        self.session = {
+            'sessionid': login.cookies['sessionid'],
+            'csrftoken': login.cookies['csrftoken']}
+        session_cache.save(self.avi_controller, self.avi_user, self.session)
+
+
     def avi_request(self,avi_api,tenant):
+        session = self.session
+        resp = self.avi_failover(lambda: self._avi_request(avi_api,tenant,session))
+        if resp.status_code == 401:
+            resp = self._avi_request(avi_api,tenant,self.avi_relogin(session))
+        return resp
+
+
+    def _avi_request(self,avi_api,tenant,session):
         headers = ({"X-Avi-Tenant": "%s" %tenant, 'content-type': 'application/json'})
-        return requests.get('https://%s/api/%s' %(self.avi_controller,avi_api), verify=False, headers = headers,cookies=dict(sessionid= self.login.cookies['sessionid']),timeout=50)
+        return self.avi_http('GET', 'https://%s/api/%s' %(self.endpoint,avi_api), verify=False, headers = headers,cookies=dict(sessionid= session['sessionid']),timeout=50)
+
+
+    #----- Generator over every object of a collection.  The first page gives
+    #----- the object count, the remaining pages are then prefetched on the
+    #----- scheduler and their objects yielded in order as each page arrives.
+    #----- If the collection grew in the meantime the next links are followed
+    #----- from the last page.
+    def avi_paginate(self,avi_api,tenant,page_size=1000):
+        if '?' in avi_api:
+            avi_api = avi_api+'&page_size=%d' %page_size
+        else:
+            avi_api = avi_api+'?page_size=%d' %page_size
+        resp = self.avi_json(self.avi_request(avi_api,tenant))
+        for o in resp.get('results',[]):
+            yield o
+        if 'next' in resp:
+            page_count = int(math.ceil(resp['count']/float(page_size)))
+            pages = range(2, page_count+1)
+            for resp in scheduler.imap(lambda page: self.avi_json(self.avi_request(avi_api+'&page=%d' %page,tenant)), pages):
+                for o in resp.get('results',[]):
+                    yield o
+        while 'next' in resp:
+            next_api = avi_api+'&page=%s' %resp['next'].split('page=',1)[1].split('&',1)[0]
+            resp = self.avi_json(self.avi_request(next_api,tenant))
+            for o in resp.get('results',[]):
+                yield o
 
 
     def avi_post(self,api_url,tenant,payload):
-        headers = ({"X-Avi-Tenant": "%s" %tenant, 'content-type': 'application/json','referer': 'https://%s' %self.avi_controller, 'X-CSRFToken': dict(self.login.cookies)['csrftoken']})
-        cookies = dict(sessionid= self.login.cookies['sessionid'],csrftoken=self.login.cookies['csrftoken'])
-        return requests.post('https://%s/api/%s' %(self.avi_controller,api_url), verify=False, headers = headers,cookies=cookies, data=json.dumps(payload),timeout=50)
+        session = self.session
+        resp = self.avi_failover(lambda: self._avi_post(api_url,tenant,payload,session))
+        if resp.status_code == 401:
+            resp = self._avi_post(api_url,tenant,payload,self.avi_relogin(session))
+        return resp
+
+
+    def _avi_post(self,api_url,tenant,payload,session):
+        headers = ({"X-Avi-Tenant": "%s" %tenant, 'content-type': 'application/json','referer': 'https://%s' %self.endpoint, 'X-CSRFToken': session['csrftoken']})
+        cookies = dict(sessionid= session['sessionid'],csrftoken=session['csrftoken'])
+        return self.avi_http('POST', 'https://%s/api/%s' %(self.endpoint,api_url), verify=False, headers = headers,cookies=cookies, data=json.dumps(payload),timeout=50)
+
+
+    #----- Runs request against the current endpoint.  When the endpoint of a
+    #----- cluster can not be reached the request is sent once more to the
+    #----- member that took over.
+    def avi_failover(self, request):
+        endpoint = self.endpoint
+        try:
+            return request()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if len(self.cluster) == 0:
+                raise
+            self.failover(endpoint)
+            return request()
+
+
+    #----- Called by every worker whose request to failed_endpoint failed,
+    #----- only the first one looks for a new leader
+    def failover(self, failed_endpoint):
+        with self.endpoint_lock:
+            if self.endpoint == failed_endpoint:
+                self.log.warning('%s is not answering, looking for the cluster leader', failed_endpoint)
+                self.resolve_endpoint(exclude=[failed_endpoint])
+                if self.endpoint == failed_endpoint:
+                    raise Exception('no member of the cluster answered')
+
+
+    #----- Sets the endpoint to the cluster leader.  The leader is cached for
+    #----- leader_ttl seconds, otherwise every member is asked at the same time
+    #----- with a short timeout and the first answer is used so a member that
+    #----- is down does not delay the cycle.  Members in exclude have failed,
+    #----- when another member still reports one of them as leader the member
+    #----- that answered is used instead.
+    def resolve_endpoint(self, exclude=()):
+        if len(self.cluster) == 0:
+            return
+        if len(exclude) == 0 and time.time() - self.endpoint_time < leader_ttl:
+            return
+        key = ','.join(sorted(self.cluster))
+        cached = leader_cache.load(key, self.avi_user)
+        if cached != None and cached['leader'] not in exclude and time.time() - cached['time'] < leader_ttl:
+            self.endpoint = cached['leader']
+            self.endpoint_time = cached['time']
+            return
+        candidates = [m for m in self.cluster if m not in exclude]
+        if len(candidates) == 0:
+            return
+        probes = ThreadPool(len(candidates))
+        try:
+            for result in probes.imap_unordered(self.probe_leader, candidates):
+                if result != None:
+                    member, leader = result
+                    #----- node names have no port, the member of that host is
+                    #----- used so a port in the member list is kept
+                    if member.split(':')[0] == leader:
+                        leader = member
+                    for m in self.cluster:
+                        if m.split(':')[0] == leader:
+                            leader = m
+                            break
+                    if leader in exclude:
+                        leader = member
+                    if leader != self.endpoint:
+                        self.log.info('cluster leader is %s', leader)
+                    self.endpoint = leader
+                    self.endpoint_time = time.time()
+                    leader_cache.save(key, self.avi_user, {'leader': leader, 'time': self.endpoint_time})
+                    return
+        finally:
+            probes.terminate()
+        self.log.warning('no member of the cluster %s answered', key)
+
+
+    #----- Returns the member and the leader it reports, or None when the
+    #----- member does not answer.  The current session is tried first, a
+    #----- login is only done when it is rejected.
+    def probe_leader(self, member):
+        try:
+            session = self.session or session_cache.load(self.avi_controller, self.avi_user)
+            url = 'https://%s/api/cluster/runtime' %member
+            resp = None
+            if session != None:
+                resp = self.avi_http('GET', url, verify=False, cookies=dict(sessionid= session['sessionid']), timeout=leader_probe_timeout)
+            if resp == None or resp.status_code == 401:
+                login = self.avi_http('POST', 'https://%s/login' %member, verify=False, data={'username': self.avi_user, 'password': self.avi_pass}, timeout=leader_probe_timeout)
+                resp = self.avi_http('GET', url, verify=False, cookies=dict(sessionid= login.cookies['sessionid']), timeout=leader_probe_timeout)
+            for node in resp.json()['node_states']:
+                if node['role'] == 'CLUSTER_LEADER':
+                    return member, node['name']
+        except:
+            self.log.info('cluster member %s did not answer', member)
+        return None
+
+
+    #----- Decodes a response body once, with the fastest json module installed
+    def avi_json(self, resp):
+        return fast_json.loads(resp.content)
 
 
 
@@ -234,15 +1723,15 @@ class avi_metrics():
     def srvc_engn_vs_count(self):
         try:
             temp_start_time = time.time()
-            discovered_vs = []  #--- this is used b/c vs in admin show up in other tenants
+            discovered_vs = set()  #--- this is used b/c vs in admin show up in other tenants
             srvc_engn_dict = {}
             for t in self.tenants:
-                srvc_engn_list = self.avi_request('serviceengine?page_size=1000',t['name']).json()['results']
+                srvc_engn_list = self.inventory.get('serviceengine',t['name'])
                 for entry in srvc_engn_list:
                     if 'consumers' in entry.keys():
                         for v in entry['consumers']:
                             if entry['name']+v['con_uuid'] not in discovered_vs:
-                                discovered_vs.append(entry['name']+v['con_uuid'])
+                                discovered_vs.add(entry['name']+v['con_uuid'])
                                 if entry['name'] not in srvc_engn_dict:
                                     srvc_engn_dict[entry['name']] = 1
                                 else:
@@ -252,180 +1741,75 @@ class avi_metrics():
                             srvc_engn_dict[entry['name']] = 0
             if len(srvc_engn_dict) > 0:
                 for entry in srvc_engn_dict:
-                    send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.vs_count' %entry, srvc_engn_dict[entry], int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_vs_count completed, executed in '+temp_total_time+' seconds')
+                    graphite.send(self.namespace('serviceengine', entry, 'vs_count'), srvc_engn_dict[entry], int(time.time()))
+            self.log.info('func srvc_engn_vs_count completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_vs_count encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func srvc_engn_vs_count encountered an error')
 
     #-----------------------------------
 
     def srvc_engn_count(self):
         try:
             temp_start_time = time.time()
-            discovered_ses = []  #--- this is used b/c se in admin show up in other tenants
+            discovered_ses = set()  #--- this is used b/c se in admin show up in other tenants
             se_count = 0
             for t in self.tenants:
-                resp = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-                if resp['count'] != 0:
-                    for s in resp['results']:
+                for s in self.inventory.get('serviceengine',t['name']):
                         if s['name'] not in discovered_ses:
                             se_count +=1
-                            discovered_ses.append(s['name'])
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.count',se_count, int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_count completed, executed in '+temp_total_time+' seconds')
+                            discovered_ses.add(s['name'])
+            graphite.send(self.namespace('serviceengine', 'count'),se_count, int(time.time()))
+            self.log.info('func srvc_engn_count completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_count encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func srvc_engn_count encountered an error')
 
 
     #-----------------------------------
-
-#    def srvc_engn_stats(self):
-#        try:
-#            temp_start_time = time.time()
-#            graphite_class_list = []
-#            discovered_ses = []  #--- this is used b/c se in admin show up in other tenants
-#            discovered_health = []
-#            se_dict = {}
-#            for t in self.tenants:
-#                srvc_engn_list = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-#                if srvc_engn_list['count'] != 0:
-#                    for s in srvc_engn_list['results']:
-#                        se_dict[s['uuid']] = s['name']
-#                    avi_api = 'analytics/metrics/serviceengine/?metric_id=%s&page_size=1000&limit=1&step=300' %self.se_metric_list
-#                    se_stat = self.avi_request(avi_api,t['name']).json()['results']
-#                    for s in se_stat:
-#                        se_name = se_dict[s['entity_uuid']]
-#                        if se_name not in discovered_ses:
-#                            discovered_ses.append(se_name)
-#                            for entry in s['series']:
-#                                class graphite_class(): pass
-#                                metric_name = entry['header']['name'].replace('.','_')
-#                                metric_value = entry['data'][0]['value']
-#                                x = graphite_class
-#                                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.%s' %(se_name, metric_name)
-#                                x.value = metric_value
-#                                x.timestamp = int(time.time())
-#                                graphite_class_list.append(x)
-#                    #----- PULL SERVICE ENGINE HEALTHSCORES
-#                    avi_api = 'analytics/healthscore/serviceengine?page_size=1000'
-#                    se_healthscore = self.avi_request(avi_api,t['name']).json()['results']
-#                    for s in se_healthscore:
-#                        se_name = se_dict[s['entity_uuid']]
-#                        if se_name not in discovered_health:
-#                            discovered_health.append(se_name)
-#                            class graphite_class(): pass
-#                            health_metric = s['series'][0]['data'][0]['value']
-#                            x = graphite_class
-#                            x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.healthscore' %se_name
-#                            x.value = health_metric
-#                            x.timestamp = int(time.time())
-#                            graphite_class_list.append(x)
-#                    self.se_vnic_portgroup(graphite_class_list,t['name']) #---- Run function to look at se portgroup membership
-#                    self.se_missed_hb(srvc_engn_list,graphite_class_list)  #---- Run function to look for missed heartbeats
-#            if len(graphite_class_list) > 0:
-#                send_class_list_graphite(graphite_class_list)
-#            temp_total_time = str(time.time()-temp_start_time)
-#            if args.debug == True:
-#                print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_stats completed, executed in '+temp_total_time+' seconds')
-#        except:
-#            print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_stats encountered an error')
-#            exception_text = traceback.format_exc()
-#            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
-
-
     def srvc_engn_stats(self):
         try:
             temp_start_time = time.time()
             graphite_class_list = []
-            discovered_ses = []  #--- this is used b/c se in admin show up in other tenants
-            discovered_health = []
+            discovered_ses = set()  #--- this is used b/c se in admin show up in other tenants
+            discovered_health = set()
             se_dict = {}
             for t in self.tenants:
-                srvc_engn_list = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-                if srvc_engn_list['count'] != 0:
-                    for s in srvc_engn_list['results']:
-                        se_dict[s['uuid']] = s['name']
-                    payload = {
-                        "metric_requests": [
-                            {
-                                "step": 300,
-                                "limit": 1,
-                                "aggregate_entity": False,
-                                "entity_uuid": "*",
-                                "se_uuid": "*",
-                                "id": "collItemRequest:AllSEs",
-                                "metric_id": self.se_metric_list
-                            }
-                            ]}
-                    se_stat = self.avi_post('analytics/metrics/collection?pad_missing_data=false', t['name'], payload).json()
-                    payload = {
-                        "metric_requests": [
-                            {
-                                "step": 60,
-                                "limit": 1,
-                                "aggregate_entity": False,
-                                "entity_uuid": "*",
-                                "se_uuid": "*",
-                                "id": "collItemRequest:AllSEs",
-                                "metric_id": self.se_metric_list
-                            }
-                            ]}
-                    realtime_stat = self.avi_post('analytics/metrics/collection?pad_missing_data=false', t['name'], payload).json()
-                    se_stat['series']['collItemRequest:AllSEs'].update(realtime_stat['series']['collItemRequest:AllSEs'])
-                    for s in se_stat['series']['collItemRequest:AllSEs']:
+                srvc_engn_list = self.inventory.get('serviceengine',t['name'])
+                if len(srvc_engn_list) != 0:
+                    se_dict.update(self.inventory.uuid_names('serviceengine',t['name']))
+                    se_stat = self.metric_queries.get(t['name'], 'AllSEs', steps=(300,60))
+                    for s in se_stat:
                         se_name = se_dict[s]
                         if se_name not in discovered_ses:
-                            discovered_ses.append(se_name)
-                            for entry in se_stat['series']['collItemRequest:AllSEs'][s]:
+                            discovered_ses.add(se_name)
+                            for entry in se_stat[s]:
                                 if 'data' in entry:
-                                    class graphite_class(): pass
-                                    metric_name = entry['header']['name'].replace('.','_')
+                                    metric_name = self.clean_name(entry['header']['name'])
                                     metric_value = entry['data'][0]['value']
-                                    x = graphite_class
-                                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.%s' %(se_name, metric_name)
-                                    x.value = metric_value
-                                    x.timestamp = int(time.time())
-                                    graphite_class_list.append(x)
+                                    graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, metric_name), metric_value, int(time.time())))
                     #----- PULL SERVICE ENGINE HEALTHSCORES
-                    avi_api = 'analytics/healthscore/serviceengine?page_size=1000'
-                    se_healthscore = self.avi_request(avi_api,t['name']).json()['results']
-                    for s in se_healthscore:
+                    for s in self.avi_paginate('analytics/healthscore/serviceengine',t['name']):
                         se_name = se_dict[s['entity_uuid']]
                         if se_name not in discovered_health:
-                            discovered_health.append(se_name)
-                            class graphite_class(): pass
+                            discovered_health.add(se_name)
                             health_metric = s['series'][0]['data'][0]['value']
-                            x = graphite_class
-                            x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.healthscore' %se_name
-                            x.value = health_metric
-                            x.timestamp = int(time.time())
-                            graphite_class_list.append(x)
+                            graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, 'healthscore'), health_metric, int(time.time())))
                     self.se_vnic_portgroup(graphite_class_list,t['name']) #---- Run function to look at se portgroup membership
                     self.se_missed_hb(srvc_engn_list,graphite_class_list)  #---- Run function to look for missed heartbeats
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_stats completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('func srvc_engn_stats completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func srvc_engn_stats encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func srvc_engn_stats encountered an error')
 
     #-----------------------------------
 
     def se_bgp_peer_state(self):
         try:
             temp_start_time = time.time()
-            srvc_engn_list = self.avi_request('serviceengine?page_size=1000','admin').json()['results']
+            srvc_engn_list = self.inventory.get('serviceengine','admin')
             graphite_class_list = []
             for s in srvc_engn_list:
                 b = self.avi_request('serviceengine/'+s['uuid']+'/bgp','admin').json()
@@ -434,27 +1818,19 @@ class avi_metrics():
                         if 'peers' in entry:
                             se_name = s['name']
                             for p in entry['peers']:
-                                peer_ip = p['peer_ip'].replace('.','_')
+                                peer_ip = self.clean_name(p['peer_ip'])
                                 if 'Established' in p['bgp_state']:
                                     peer_state = 100
                                 else:
                                     peer_state = 50
-                                #send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.bgp-peer.%s' %(se_name, peer_ip), peer_state, int(time.time()))
-                                class graphite_class(): pass
-                                x = graphite_class
-                                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.bgp-peer.%s' %(se_name, peer_ip)
-                                x.value = peer_state
-                                x.timestamp = int(time.time())
-                                graphite_class_list.append(x)
+                                #graphite.send(self.namespace('serviceengine', se_name, 'bgp-peer', peer_ip), peer_state, int(time.time()))
+                                graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, 'bgp-peer', peer_ip), peer_state, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': se_bgp_peer_state, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('se_bgp_peer_state, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': se_bgp_peer_state encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('se_bgp_peer_state encountered an error')
 
 
 
@@ -462,16 +1838,7 @@ class avi_metrics():
     #--- This function will loop through all tenants pulling the following statistics
     #--- for all Virtual Services.
     def virtual_service_stats_threaded(self):
-        #tenants = self.avi_request('tenant?page_size=1000','admin')
-        proc = []
-        #for t in tenants.json()['results']:
-        for t in self.tenants:
-            t_name = t['name']
-            p = Process(target = self.virtual_service_stats, args = (t_name,))
-            p.start()
-            proc.append(p)
-        for p in proc:
-            p.join()
+        scheduler.map(lambda t: self.virtual_service_stats(t['name']), self.tenants)
 
 
 
@@ -480,128 +1847,112 @@ class avi_metrics():
         try:
             temp_start_time = time.time()
             #-----
-            virtual_services = self.avi_request('virtualservice?page_size=1000',tenant).json()
-            if virtual_services['count'] !=0:
+            vs_dict = self.inventory.uuid_names('virtualservice',tenant)
+            if len(vs_dict) !=0:
                 graphite_class_list = []
-                vs_dict= {}
-                for v in virtual_services['results']:
-                    vs_uuid = v['uuid']
-                    vs_name = v['name']
-                    vs_dict[vs_uuid] = vs_name
-                payload =  {'metric_requests': [{'step' : 300, 'limit': 1, 'id': 'allvs', 'entity_uuid' : '*', 'metric_id': self.vs_metric_list}]}
-                vs_stats = self.avi_post('analytics/metrics/collection?pad_missing_data=false', tenant, payload).json()
-                #----- this pulls 1 min avg stats for vs that have realtime stats enabled
-                payload =  {'metric_requests': [{'step' : 60, 'limit': 1, 'id': 'allvs', 'entity_uuid' : '*', 'metric_id': self.vs_metric_list}]}
-                realtime_stats = self.avi_post('analytics/metrics/collection?pad_missing_data=false', tenant, payload).json()
-                #----- overwrites real time vs' 5 min avg with the 1 min avg
-                vs_stats['series']['allvs'].update(realtime_stats['series']['allvs'])
-                #----- THIS IS NEW
-                for v in vs_stats['series']['allvs']:
+                #----- 5 min averages, overwritten by the 1 min averages of
+                #----- vs that have realtime stats enabled
+                vs_stats = self.metric_queries.get(tenant, 'allvs', steps=(300,60))
+                for v in vs_stats:
                     if v in vs_dict:
                         vs_uuid = v
-                        vs_name = vs_dict[vs_uuid].replace('.','_')
-                        for m in vs_stats['series']['allvs'][v]:
-                            class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                            metric_name = m['header']['name'].replace('.','_')
+                        vs_name = self.clean_name(vs_dict[vs_uuid])
+                        for m in vs_stats[v]:
+                            metric_name = self.clean_name(m['header']['name'])
                             if 'data' in m:
                                 metric_value = m['data'][0]['value']
-                                x = graphite_class
-                                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.%s' %(vs_name, metric_name)
-                                x.value = metric_value
-                                x.timestamp = int(time.time())
-                                graphite_class_list.append(x)
-                send_class_list_graphite(graphite_class_list)
+                                graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_name, metric_name), metric_value, int(time.time())))
+                graphite.send_list(graphite_class_list)
             #-----------------------------------
             #----- SEND SUM OF VS_COUNT LIST - TOTAL NUMBER OF VS
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func virtual_service_stats completed for tenant: '+tenant+', executed in '+temp_total_time+' seconds')
+            self.log.info('func virtual_service_stats completed for tenant: %s, executed in %s seconds', tenant, time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func virtual_service_stats encountered an error for tenant'+tenant)
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func virtual_service_stats encountered an error for tenant%s', tenant)
 
 
 
+    #----- VS stats per SE are pulled with one paged query per tenant, the
+    #----- query asks for every vs/se pair and the series are split by se locally
     def vs_metrics_per_se_threaded(self):
         try:
             temp_start_time = time.time()
             #tenants = self.avi_request('tenant?page_size=1000','admin')
             vs_dict= {}
-            proc = []
-            admin_vs = []
+            tenant_tasks = []
+            admin_vs = set()
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                virtual_services = self.avi_request('virtualservice?page_size=1000',t['name']).json()
-                if virtual_services['count'] !=0:
-                    for v in virtual_services['results']:
-                        vs_uuid = v['uuid']
-                        vs_name = v['name']
-                        vs_dict[vs_uuid] = vs_name
-                        if t['name'] == 'admin':
-                            admin_vs.append(vs_uuid)
+                for v in self.inventory.get('virtualservice',t['name']):
+                    vs_uuid = v['uuid']
+                    vs_name = v['name']
+                    vs_dict[vs_uuid] = vs_name
+                    if t['name'] == 'admin':
+                        admin_vs.add(vs_uuid)
             if len(vs_dict) > 0:
                 for t in self.tenants:
-                    srvc_engn_list = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-                    if srvc_engn_list['count'] != 0:
-                        se_dict = {}
-                        for s in srvc_engn_list['results']:
-                            se_dict[s['uuid']] = s['name']
-                        for se in se_dict:
-                            p = Process(target = self.vs_metrics_per_se, args = (se_dict,vs_dict,se,t['name'],admin_vs,))
-                            p.start()
-                            proc.append(p)
-                        for p in proc:
-                            p.join()
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vs_metrics_per_se_threaded completed, executed in '+temp_total_time+' seconds')
+                    se_dict = self.inventory.uuid_names('serviceengine',t['name'])
+                    if len(se_dict) != 0:
+                        tenant_tasks.append((se_dict,t['name']))
+                scheduler.map(lambda task: self.vs_metrics_per_se(task[0],vs_dict,task[1],admin_vs), tenant_tasks)
+            self.log.info('func vs_metrics_per_se_threaded completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_metrics_per_se_threaded encountered an error')
 
 
 
 
 
-    def vs_metrics_per_se(self,se_dict,vs_dict,se,tenant,admin_vs):
+    def vs_metrics_per_se(self,se_dict,vs_dict,tenant,admin_vs):
         try:
             temp_start_time = time.time()
             graphite_class_list = []
-            payload =  {'metric_requests': [{'step' : 300, 'limit': 1, 'id': 'vs_metrics_by_se', 'entity_uuid' : '*', 'serviceengine_uuid': se, 'include_refs': True, 'metric_id': self.vs_metric_list}]}
-            vs_stats = self.avi_post('analytics/metrics/collection?pad_missing_data=false', tenant, payload).json()
-            #----- this will pull 1 min stats for vs that have realtime stat enabled
-            payload =  {'metric_requests': [{'step' : 60, 'limit': 1, 'id': 'vs_metrics_by_se', 'entity_uuid' : '*', 'serviceengine_uuid': se, 'include_refs': True, 'metric_id': self.vs_metric_list}]}
-            realtime_stats = self.avi_post('analytics/metrics/collection?pad_missing_data=false', tenant, payload).json()
-            #----- overwrite 5 min avg stats with 1 min avg stats for vs that have realtime stats enabled
-            vs_stats['series']['vs_metrics_by_se'].update(realtime_stats['series']['vs_metrics_by_se'])
-            if len(vs_stats['series']['vs_metrics_by_se']) > 0:
-                for entry in vs_stats['series']['vs_metrics_by_se']:
-                    if tenant == 'admin' and entry not in admin_vs:
-                        continue
-                    elif tenant != 'admin' and entry in admin_vs:
-                        continue
-                    else:
-                        vs_name = vs_dict[entry].replace('.','_')
-                        for d in vs_stats['series']['vs_metrics_by_se'][entry]:
-                            if 'data' in d:
-                                class graphite_class(): pass
-                                metric_name = d['header']['name'].replace('.','_')
-                                metric_value = d['data'][0]['value']
-                                x = graphite_class
-                                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.virtualservice_stats.%s.%s' %(se_dict[se],vs_name,metric_name)
-                                x.value = metric_value
-                                x.timestamp = int(time.time())
-                                graphite_class_list.append(x)
-                if len(graphite_class_list) > 0:
-                    send_class_list_graphite(graphite_class_list)
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func vs_metrics_per_se completed for se '+se_dict[se]+' tenant: '+tenant+', executed in '+temp_total_time+' seconds')
+            #----- 1 min stats replace the 5 min stats for vs that have realtime stats enabled
+            vs_stats = {}
+            for step in (300,60):
+                for pair, series in self.vs_se_series(tenant, step):
+                    vs_stats[pair] = series
+            for vs_uuid, se_uuid in vs_stats:
+                if tenant == 'admin' and vs_uuid not in admin_vs:
+                    continue
+                elif tenant != 'admin' and vs_uuid in admin_vs:
+                    continue
+                elif vs_uuid in vs_dict and se_uuid in se_dict:
+                    vs_name = self.clean_name(vs_dict[vs_uuid])
+                    for d in vs_stats[(vs_uuid, se_uuid)]:
+                        if 'data' in d:
+                            metric_name = self.clean_name(d['header']['name'])
+                            metric_value = d['data'][0]['value']
+                            graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_dict[se_uuid], 'virtualservice_stats', vs_name, metric_name), metric_value, int(time.time())))
+            if len(graphite_class_list) > 0:
+                graphite.send_list(graphite_class_list)
+            self.log.info('func vs_metrics_per_se completed for tenant: %s, executed in %s seconds', tenant, time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vs_metrics_per_se for se '+se_dict[se]+' tenant: '+tenant+', encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_metrics_per_se for tenant: %s, encountered an error', tenant)
+
+
+    #----- Generator over ((vs_uuid, se_uuid), series) of every vs/se pair of
+    #----- a tenant.  A page holds at most vs_se_page_size pairs and the next
+    #----- pages are followed until every pair was returned.  The vs and se
+    #----- are read from the series header, not from the result key.
+    def vs_se_series(self, tenant, step):
+        api = 'analytics/metrics/virtualservice?entity_uuid=*&serviceengine_uuid=*&limit=1&step=%d&include_refs=true&pad_missing_data=false&dimension_limit=%d&metric_id=%s' %(step, vs_se_page_size, self.vs_metric_list)
+        for r in self.avi_paginate(api, tenant, page_size=vs_se_page_size):
+            pairs = {}
+            for m in r.get('series', []):
+                header = m.get('header', {})
+                se_uuid = header.get('serviceengine_uuid')
+                for d in header.get('dimension_data', []):
+                    if d.get('dimension') == 'METRICS_DIMENSION_SE':
+                        se_uuid = d.get('dimension_id')
+                if se_uuid == None:
+                    continue
+                pair = (header.get('entity_uuid', r.get('entity_uuid')), se_uuid)
+                pairs.setdefault(pair, []).extend(compact_series([m]))
+            for pair in pairs:
+                yield pair, pairs[pair]
 
 
 
@@ -618,24 +1969,16 @@ class avi_metrics():
             graphite_class_list = []
             vs_dict = {}
             for t in self.tenants:
-                virtual_services = self.avi_request('virtualservice-inventory?page_size=1000&include=health_score',t['name']).json()['results']
+                virtual_services = self.inventory.get('virtualservice-inventory?include=health_score',t['name'])
                 for v in virtual_services:
-                    vs_name = v['config']['name'].replace('.','_')
+                    vs_name = self.clean_name(v['config']['name'])
                     vs_healthscore = v['health_score']['health_score']
-                    class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                    x = graphite_class
-                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.healthscore' %vs_name
-                    x.value = vs_healthscore
-                    x.timestamp = int(time.time())
-                    graphite_class_list.append(x)
-            send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vs_healthscores completed, executed in '+temp_total_time+' seconds')
+                    graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_name, 'healthscore'), vs_healthscore, int(time.time())))
+            graphite.send_list(graphite_class_list)
+            self.log.info('func vs_healthscores completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vs_healthscores encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_healthscores encountered an error')
 
 
 
@@ -650,11 +1993,10 @@ class avi_metrics():
             vs_disabled_count = 0
             vs_count = 0
             for t in self.tenants:
-                virtual_service_status = self.avi_request('virtualservice-inventory?page_size=1000',t['name']).json()['results']
+                virtual_service_status = self.inventory.get('virtualservice-inventory',t['name'])
                 vs_count += len(virtual_service_status)
                 for v in virtual_service_status:
-                    class graphite_class(): pass
-                    vs_name = v['config']['name'].replace('.','_')
+                    vs_name = self.clean_name(v['config']['name'])
                     metric_name = 'oper_status'
                     if v['runtime']['oper_status']['state'] == 'OPER_UP':
                         metric_value = 1
@@ -666,23 +2008,16 @@ class avi_metrics():
                     else:
                         metric_value = 0
                         vs_down_count += 1
-                    x = graphite_class
-                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.%s' %(vs_name, metric_name)
-                    x.value = metric_value
-                    x.timestamp = int(time.time())
-                    graphite_class_list.append(x)
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.count', vs_count, int(time.time()))
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.status_up', vs_up_count, int(time.time()))
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.status_down', vs_down_count, int(time.time()))
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.status_disabled', vs_disabled_count, int(time.time()))
-            send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vs_oper_status completed, executed in '+temp_total_time+' seconds')
+                    graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_name, metric_name), metric_value, int(time.time())))
+            graphite.send(self.namespace('virtualservice', 'count'), vs_count, int(time.time()))
+            graphite.send(self.namespace('virtualservice', 'status_up'), vs_up_count, int(time.time()))
+            graphite.send(self.namespace('virtualservice', 'status_down'), vs_down_count, int(time.time()))
+            graphite.send(self.namespace('virtualservice', 'status_disabled'), vs_disabled_count, int(time.time()))
+            graphite.send_list(graphite_class_list)
+            self.log.info('func vs_oper_status completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vs_oper_status encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_oper_status encountered an error')
 
 
 
@@ -695,63 +2030,67 @@ class avi_metrics():
             graphite_class_list = []
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                avi_api = 'pool-inventory?page_size=1000'
-                pool_member_status = self.avi_request(avi_api,t['name']).json()
-                if pool_member_status['count'] > 0:
-                    vs_dict= {}
-                    virtual_services = self.avi_request('virtualservice?page_size=1000',t['name']).json()
-                    if virtual_services['count'] !=0:
-                        for v in virtual_services['results']:
-                            vs_uuid = v['uuid']
-                            vs_name = v['name']
-                            vs_dict[vs_uuid] = vs_name
-                    for p in pool_member_status['results']:
+                pool_member_status = self.inventory.get('pool-inventory',t['name'])
+                if len(pool_member_status) > 0:
+                    vs_dict = self.inventory.uuid_names('virtualservice',t['name'])
+                    for p in pool_member_status:
                         try:
                             vs_list = []
                             if 'num_servers' in p['runtime']:
                                 if 'virtualservice' in p:
-                                    vs_list.append(p['virtualservice']['name'].replace('.','_'))
+                                    vs_list.append(self.clean_name(p['virtualservice']['name']))
                                 elif 'virtualservices' in p:
                                     for v in p['virtualservices']:
                                         vs_list.append(vs_dict[v.rsplit('/',1)[1].replace('.','_')])
-                                pool_name = p['config']['name'].replace('.','_')
+                                pool_name = self.clean_name(p['config']['name'])
                                 pool_members_up = p['runtime']['num_servers_up']
                                 pool_members_enabled = p['runtime']['num_servers_enabled']
                                 pool_members = p['runtime']['num_servers']
                                 for vs_entry in vs_list:
-                                    class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                                    x = graphite_class
-                                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.pool.%s.%s' %(vs_entry, pool_name, 'pool_members_enabled')
-                                    x.value = pool_members_enabled
-                                    x.timestamp = int(time.time())
-                                    graphite_class_list.append(x)
-                                    class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                                    y = graphite_class
-                                    y.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.pool.%s.%s' %(vs_entry, pool_name, 'pool_members_up')
-                                    y.value = pool_members_up
-                                    y.timestamp = int(time.time())
-                                    graphite_class_list.append(y)
-                                    class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                                    z = graphite_class
-                                    z.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.pool.%s.%s' %(vs_entry, pool_name, 'pool_members')
-                                    z.value = pool_members
-                                    z.timestamp = int(time.time())
-                                    graphite_class_list.append(z)
+                                    graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_entry, 'pool', pool_name, 'pool_members_enabled'), pool_members_enabled, int(time.time())))
+                                    graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_entry, 'pool', pool_name, 'pool_members_up'), pool_members_up, int(time.time())))
+                                    graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_entry, 'pool', pool_name, 'pool_members'), pool_members, int(time.time())))
                         except:
                             #_=1
-                            exception_text = traceback.format_exc()
-                            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+                            self.stats.record_error()
+                            self.log.exception('func vs_active_pool_members encountered an error for pool %s', p.get('config', {}).get('name'))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vs_active_pool_members completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('func vs_active_pool_members completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vs_active_pool_members encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_active_pool_members encountered an error')
+
+
+
 
 
+    #-----------------------------------
+    #----- significant log count of every vs in a tenant from a single logs
+    #----- query grouped by virtualservice, the next pages are followed when
+    #----- there are more groups than fit a page.  Returns None if the
+    #----- controller did not return grouped results or the search did not
+    #----- finish within its timeout, the counts are then incomplete.
+    def vs_sig_log_counts(self,tenant):
+        avi_api = 'analytics/logs?type=1&duration=60&groupby=virtualservice&page_size=10000&timeout=2'
+        log_counts = {}
+        page = 1
+        while True:
+            resp = self.avi_request(avi_api+'&page=%d' %page,tenant)
+            if resp.status_code != 200:
+                return None
+            resp = self.avi_json(resp)
+            if 'results' not in resp:
+                return None
+            if resp.get('percent_remaining', 0) > 0 or resp.get('partial') == True:
+                self.log.warning('significant log search for tenant %s did not complete, counting per virtual service', tenant)
+                return None
+            for entry in resp['results']:
+                if entry.get('value'):
+                    log_counts[entry['value']] = entry['count']
+            if 'next' not in resp:
+                return log_counts
+            page += 1
 
 
 
@@ -759,54 +2098,42 @@ class avi_metrics():
     #----- get significant log count for current VS
     def vs_sig_log_count(self,v,tenant):
         try:
-                temp_start_time = time.time()
-            #graphite_class_list = []
-            #virtual_services = self.avi_request('virtualservice-inventory?page_size=1000','*').json()['results']
-            #for v in virtual_services:
-                class graphite_class(): pass
-                vs_name = v['config']['name'].replace('.','_')
-                vs_uuid = v['uuid']
-                avi_api = 'analytics/logs?type=1&virtualservice=%s&duration=60' %vs_uuid
-                resp = self.avi_request(avi_api,tenant).json()
-                if 'count' in resp:
-                    log_count = resp['count']
-                    send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.%s' %(vs_name, 'significant_log_count'), log_count, int(time.time()))
-                #x = graphite_class
-                #x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.%s' %(vs_name, 'significant_log_count')
-                #x.value = log_count
-                #x.timestamp = int(time.time())
-                #graphite_class_list.append(x)
-                #send_class_list_graphite(graphite_class_list)
-                temp_total_time = str(time.time()-temp_start_time)
-                #print(str(datetime.now())+' '+self.avi_controller+': func vs_sig_log_count completed, executed in '+temp_total_time+' seconds')
-
+            avi_api = 'analytics/logs?type=1&virtualservice=%s&duration=60' %v['uuid']
+            return self.avi_request(avi_api,tenant).json().get('count')
         except:
-            #print(str(datetime.now())+' '+self.avi_controller+': func vs_sig_log_count encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_sig_log_count encountered an error for %s', v['config']['name'])
 
 
+
+    #-----------------------------------
+    #----- vs that had no significant logs are not part of the grouped results
+    #----- and are sent as 0.  If grouping fails or the grouped search did not
+    #----- complete the vs are queried one by one, at most sig_log_workers at a
+    #----- time as the logs api is expensive on the controller.
     def vs_sig_log_count_threaded(self):
         try:
             temp_start_time = time.time()
-            #graphite_class_list = []
+            graphite_class_list = []
             for t in self.tenants:
-                virtual_services = self.avi_request('virtualservice-inventory?page_size=1000',t['name']).json()['results']
-                proc = []
+                virtual_services = self.inventory.get('virtualservice-inventory',t['name'])
+                if len(virtual_services) == 0:
+                    continue
+                log_counts = self.vs_sig_log_counts(t['name'])
+                if log_counts == None:
+                    counts = scheduler.imap(lambda v: self.vs_sig_log_count(v,t['name']), virtual_services, window=sig_log_workers)
+                    log_counts = dict(zip([v['uuid'] for v in virtual_services], counts))
                 for v in virtual_services:
-                    p = Process(target = self.vs_sig_log_count, args = (v,t['name'],))
-                    p.start()
-                    proc.append(p)
-                for p in proc:
-                    p.join()
-            #send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vs_sig_log_count_threaded completed, executed in '+temp_total_time+' seconds')
+                    log_count = log_counts.get(v['uuid'], 0)
+                    if log_count != None:
+                        vs_name = self.clean_name(v['config']['name'])
+                        graphite_class_list.append(graphite_sample(self.namespace('virtualservice', vs_name, 'significant_log_count'), log_count, int(time.time())))
+            if len(graphite_class_list) > 0:
+                graphite.send_list(graphite_class_list)
+            self.log.info('func vs_sig_log_count_threaded completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vs_sig_log_count_threaded encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vs_sig_log_count_threaded encountered an error')
 
 
 
@@ -816,8 +2143,7 @@ class avi_metrics():
     #----- called by service_engine_stats function
     def se_vnic_portgroup(self,graphite_class_list,tenant):
         try:
-            se_vnic_info = self.avi_request('vimgrsevmruntime',tenant).json()['results']
-            for s in se_vnic_info:
+            for s in self.avi_paginate('vimgrsevmruntime',tenant):
                 se_name = s['name']
                 number_of_ints = len(s['guest_nic'])
                 quarantined_int = 0
@@ -830,22 +2156,12 @@ class avi_metrics():
                     elif n['network_name'] == 'quarantine':
                         quarantined_int += 1
                 if quarantined_int > 0:
-                    class graphite_class(): pass
-                    x = graphite_class
-                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.%s' %(se_name, 'quarantined_vnics')
-                    x.value = quarantined_int
-                    x.timestamp = int(time.time())
-                    graphite_class_list.append(x)
+                    graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, 'quarantined_vnics'), quarantined_int, int(time.time())))
                 elif avi_internal == number_of_ints:
-                    class graphite_class(): pass
-                    x = graphite_class
-                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.%s' %(se_name, 'aci_vnic_program_error')
-                    x.value = 1
-                    x.timestamp = int(time.time())
-                    graphite_class_list.append(x)
+                    graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, 'aci_vnic_program_error'), 1, int(time.time())))
         except:
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func se_vnic_portgroup encountered an error')
 
 
 
@@ -853,18 +2169,13 @@ class avi_metrics():
     #----- called by service_engine_stats function
     def se_missed_hb(self,srvc_engn_list,graphite_class_list):
         try:
-            for s in srvc_engn_list['results']:
+            for s in srvc_engn_list:
                 if 'hb_status' in s:
-                    class graphite_class(): pass
-                    x = graphite_class
                     se_name = s['name']
-                    x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.%s' %(se_name, 'missed_heartbeats')
-                    x.value = s['hb_status']['num_hb_misses']
-                    x.timestamp = int(time.time())
-                    graphite_class_list.append(x)
+                    graphite_class_list.append(graphite_sample(self.namespace('serviceengine', se_name, 'missed_heartbeats'), s['hb_status']['num_hb_misses'], int(time.time())))
         except:
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func se_missed_hb encountered an error')
 
 
 
@@ -880,38 +2191,22 @@ class avi_metrics():
             #---- RETURN CLUSTER MEMBER ROLE
             #---- follower = 0, leader = 1
             for c in cluster_status['node_states']:
-                class graphite_class: pass
                 if c['state'] == 'CLUSTER_ACTIVE':
                     active_members = active_members + 1
                 if c['role'] == 'CLUSTER_FOLLOWER':
                     member_role = 0
                 elif c['role'] == 'CLUSTER_LEADER':
                     member_role = 1
-                try:
-                    member_name = socket.gethostbyaddr(c['name'])[0].replace('.','_')
-                except:
-                    member_name = c['name'].replace('.','_')
-                x = graphite_class
-                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.cluster.%s.role' %member_name
-                x.value = member_role
-                x.timestamp = int(time.time())
-                graphite_class_list.append(x)
+                member_name = self.host_name(c['name'])
+                graphite_class_list.append(graphite_sample(self.namespace('cluster', member_name, 'role'), member_role, int(time.time())))
             #-----------------------------------
             #---- ADD ACTIVE MEMBER COUNT TO LIST
-            class graphite_class: pass
-            x = graphite_class
-            x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.cluster.active_members'
-            x.value = active_members
-            x.timestamp = int(time.time())
-            graphite_class_list.append(x)
-            send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func cluster_status completed, executed in '+temp_total_time+' seconds')
+            graphite_class_list.append(graphite_sample(self.namespace('cluster', 'active_members'), active_members, int(time.time())))
+            graphite.send_list(graphite_class_list)
+            self.log.info('func cluster_status completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func cluster_status encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func cluster_status encountered an error')
 
 
 
@@ -920,12 +2215,8 @@ class avi_metrics():
     def vcenter_status(self):
         try:
             temp_start_time = time.time()
-            vcenter_status = self.avi_request('vimgrvcenterruntime','admin').json()
-            for v in vcenter_status['results']:
-                try:
-                    vcenter_name = socket.gethostbyaddr(v['vcenter_url'])[0].replace('.','_')
-                except:
-                    vcenter_name = v['vcenter_url'].replace('.','_')
+            for v in self.avi_paginate('vimgrvcenterruntime','admin'):
+                vcenter_name = self.host_name(v['vcenter_url'])
                 if v['inventory_state'] == 'VCENTER_DISCOVERY_COMPLETE':
                     discovery_status = 2
                 elif v['inventory_progress'] == 'Initial State':
@@ -936,15 +2227,12 @@ class avi_metrics():
                     vcenter_connected = 2
                 else:
                     vcenter_connected = 0
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.vcenter.%s.discovery_status' %vcenter_name, discovery_status, int(time.time()))
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.vcenter.%s.vcenter_connected' %vcenter_name, vcenter_connected, int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func vcenter_status completed, executed in '+temp_total_time+' seconds')
+            graphite.send(self.namespace('vcenter', vcenter_name, 'discovery_status'), discovery_status, int(time.time()))
+            graphite.send(self.namespace('vcenter', vcenter_name, 'vcenter_connected'), vcenter_connected, int(time.time()))
+            self.log.info('func vcenter_status completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vcenter_status encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vcenter_status encountered an error')
 
 
 
@@ -952,40 +2240,29 @@ class avi_metrics():
     #-----------------------------------
     def vcenter_monitor_counters(self):
         try:
-            #----- Only run this function every 5 minutes
-            if (datetime.now().minute)%5 == 0:
-                temp_start_time = time.time()
-                vcenter_monitor_counters = self.avi_request('vinfra/internal','admin').json()
-                for v in vcenter_monitor_counters:
-                    try:
-                        vcenter_name = socket.gethostbyaddr(v['vcenter_url'])[0].replace('.','_')
-                    except:
-                        vcenter_name = v['vcenter_url'].replace('.','_')
-                    vm_mon_ver = v['datacenters'][0]['vm_monitor_list_ver']
-                    res_mon_ver = v['datacenters'][0]['resource_monitor_list_ver']
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.vcenter.%s.vm_monitor_ver' %vcenter_name, vm_mon_ver, int(time.time()))
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.vcenter.%s.res_monitor_ver' %vcenter_name, res_mon_ver, int(time.time()))
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func vcenter_monitor_counters completed, executed in '+temp_total_time+' seconds')
+            temp_start_time = time.time()
+            vcenter_monitor_counters = self.avi_request('vinfra/internal','admin').json()
+            for v in vcenter_monitor_counters:
+                vcenter_name = self.host_name(v['vcenter_url'])
+                vm_mon_ver = v['datacenters'][0]['vm_monitor_list_ver']
+                res_mon_ver = v['datacenters'][0]['resource_monitor_list_ver']
+            graphite.send(self.namespace('vcenter', vcenter_name, 'vm_monitor_ver'), vm_mon_ver, int(time.time()))
+            graphite.send(self.namespace('vcenter', vcenter_name, 'res_monitor_ver'), res_mon_ver, int(time.time()))
+            self.log.info('func vcenter_monitor_counters completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func vcenter_monitor_counters encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func vcenter_monitor_counters encountered an error')
 
 
 
 
     #-----------------------------------
     def apic_status(self):
-        if self.avi_request('cloud', 'admin').json()['results'][0]['apic_mode'] == True:
+        if self.inventory.get('cloud','admin')[0]['apic_mode'] == True:
             try:
                 temp_start_time = time.time()
-                apic_ip = self.avi_request('cloud','admin').json()['results'][0]['apic_configuration']['apic_name'][0]
-                try:
-                    apic_name = socket.gethostbyaddr(apic_ip)[0].replace('.','_')
-                except:
-                    apic_name = apic_ip.replace('.','_')
+                apic_ip = self.inventory.get('cloud','admin')[0]['apic_configuration']['apic_name'][0]
+                apic_name = self.host_name(apic_ip)
                 apic_info = self.avi_request('apic/internal','admin').json()[0]
                 if apic_info['connected'] == True:
                     apic_connection_status = 2
@@ -995,18 +2272,14 @@ class avi_metrics():
                     apic_websocket_status = 2
                 else:
                     apic_websocket_status = 0
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.apic.%s.connection_status' %apic_name, apic_connection_status, int(time.time()))
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.apic.%s.websocket_status' %apic_name, apic_websocket_status, int(time.time()))
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func apic_status completed, executed in '+temp_total_time+' seconds')
+                graphite.send(self.namespace('apic', apic_name, 'connection_status'), apic_connection_status, int(time.time()))
+                graphite.send(self.namespace('apic', apic_name, 'websocket_status'), apic_websocket_status, int(time.time()))
+                self.log.info('func apic_status completed, executed in %s seconds', time.time()-temp_start_time)
             except:
-                print(str(datetime.now())+' '+self.avi_controller+': func apic_status encountered an error')
-                exception_text = traceback.format_exc()
-                print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+                self.stats.record_error()
+                self.log.exception('func apic_status encountered an error')
         else:
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func apic_status not in Apic Mode')
+            self.log.info('func apic_status not in Apic Mode')
 
 
 
@@ -1015,30 +2288,22 @@ class avi_metrics():
     def avi_subnet_usage(self):
         try:
             temp_start_time = time.time()
-            subnets = self.avi_request('networkruntime?page_size=1000','admin').json()['results']
+            subnets = list(self.avi_paginate('networkruntime','admin'))
             if len(subnets) > 0:
                 graphite_class_list = []
                 for s in subnets:
                     if 'subnet_runtime' in s.keys():
-                        class graphite_class(): pass
-                        x = graphite_class
                         network_name = s['name'].replace('|','_').replace(':','_').replace('.','-')
                         pool_size = float(s['subnet_runtime'][0]['total_ip_count'])
                         pool_used = float(s['subnet_runtime'][0]['used_ip_count'])
                         percentage_used = int((pool_used/pool_size)*100)
-                        x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.networks.%s.used' %network_name
-                        x.value = percentage_used
-                        x.timestamp = int(time.time())
-                        graphite_class_list.append(x)
+                        graphite_class_list.append(graphite_sample(self.namespace('networks', network_name, 'used'), percentage_used, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func avi_subnet_usage completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+                self.log.info('func avi_subnet_usage completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func avi_subnet_usage encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func avi_subnet_usage encountered an error')
 
 
 
@@ -1052,31 +2317,21 @@ class avi_metrics():
             graphite_class_list = []
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                ssl_certs = self.avi_request('sslkeyandcertificate?page_size=1000',t['name']).json()
-                if ssl_certs['count'] > 0:
-                    for s in ssl_certs['results']:
-                        class graphite_class(): pass
-                        x = graphite_class()
-                        cert_name = s['name'].replace('.','_')
-                        if 'not_after' in s['certificate']:
-                            expires = datetime.strptime(s['certificate']['not_after'],"%Y-%m-%d %H:%M:%S")
-                            days_to_expire = (expires - current_time).days
-                        elif s['certificate']['expiry_status'] == 'SSL_CERTIFICATE_EXPIRED':
-                            days_to_expire = 0
-                        if days_to_expire <= 30:
-                            x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.sslcerts.%s.expires' %cert_name
-                            x.value = days_to_expire
-                            x.timestamp = int(time.time())
-                            graphite_class_list.append(x)
+                for s in self.inventory.get('sslkeyandcertificate',t['name']):
+                    cert_name = self.clean_name(s['name'])
+                    if 'not_after' in s['certificate']:
+                        expires = datetime.strptime(s['certificate']['not_after'],"%Y-%m-%d %H:%M:%S")
+                        days_to_expire = (expires - current_time).days
+                    elif s['certificate']['expiry_status'] == 'SSL_CERTIFICATE_EXPIRED':
+                        days_to_expire = 0
+                    if days_to_expire <= 30:
+                        graphite_class_list.append(graphite_sample(self.namespace('sslcerts', cert_name, 'expires'), days_to_expire, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func expiring_certs completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+                self.log.info('func expiring_certs completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func expiring_certs encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func expiring_certs encountered an error')
 
 
 
@@ -1086,31 +2341,15 @@ class avi_metrics():
         try:
             temp_start_time = time.time()
             #srvc_engn_list = self.avi_request('serviceengine','admin').json()['results']
-            vm_esx_dict = {}
-            page_number = 1
-            loop = True
-            while loop == True:
-                resp = self.avi_request('vimgrhostruntime?page_size=1000&page='+str(page_number),'admin').json()
-                if 'error' in resp:
-                    loop = False
-                else:
-                    esx_results = resp['results']
-                    for e in esx_results:
-                        esx_name = e['name'].replace('.','_')
-                        if 'vm_refs' in e:
-                            for v in e['vm_refs']:
-                                vm_uuid = v.rsplit('/',1)[1]
-                                vm_esx_dict[vm_uuid] = esx_name
-                    page_number +=1
-            discovered_vs = []
+            discovered_vs = set()
             srvc_engn_dict = {}
             for t in self.tenants:
-                srvc_engn_list = self.avi_request('serviceengine',t['name']).json()['results']
+                srvc_engn_list = self.inventory.get('serviceengine',t['name'])
                 for entry in srvc_engn_list:
                     if 'consumers' in entry.keys():
                         for v in entry['consumers']:
                             if entry['name']+v['con_uuid'] not in discovered_vs:
-                                discovered_vs.append(entry['name']+v['con_uuid'])
+                                discovered_vs.add(entry['name']+v['con_uuid'])
                                 if entry['name'] not in srvc_engn_dict:
                                     srvc_engn_dict[entry['name']] = 1
                                 else:
@@ -1120,10 +2359,9 @@ class avi_metrics():
                             srvc_engn_dict[entry['name']] = 0
             esx_vs_se_count = {}
             for s in srvc_engn_dict.keys():
-                resp = self.avi_request('vimgrvmruntime?name='+s,'admin').json()
-                if resp['count'] != 0:
-                    vm_uuid = resp['results'][0]['uuid']
-                    esx_host = vm_esx_dict[vm_uuid]
+                vm = self.esx.find('vimgrvmruntime', s, by='name')
+                if vm != None and self.esx.vm_host(vm) != None:
+                    esx_host = self.clean_name(self.esx.vm_host(vm)['name'])
                     if esx_host not in esx_vs_se_count:
                         esx_vs_se_count[esx_host]={'se':1, 'vs':srvc_engn_dict[s]}
                     else:
@@ -1131,26 +2369,13 @@ class avi_metrics():
                         esx_vs_se_count[esx_host]['vs'] += srvc_engn_dict[s]
             graphite_class_list = []
             for server in esx_vs_se_count:
-                class graphite_class(): pass
-                x = graphite_class
-                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.esx.%s.count.serviceengine' %server
-                x.value = esx_vs_se_count[server]['se']
-                x.timestamp = int(time.time())
-                graphite_class_list.append(x)
-                class graphite_class(): pass
-                y = graphite_class
-                y.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.esx.%s.count.virtualservice' %server
-                y.value = esx_vs_se_count[server]['vs']
-                y.timestamp = int(time.time())
-                graphite_class_list.append(y)
-            send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func esx_srvc_engn_vs_count completed, executed in '+temp_total_time+' seconds')
+                graphite_class_list.append(graphite_sample(self.namespace('esx', server, 'count', 'serviceengine'), esx_vs_se_count[server]['se'], int(time.time())))
+                graphite_class_list.append(graphite_sample(self.namespace('esx', server, 'count', 'virtualservice'), esx_vs_se_count[server]['vs'], int(time.time())))
+            graphite.send_list(graphite_class_list)
+            self.log.info('func esx_srvc_engn_vs_count completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func esx_srvc_engn_vs_count encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func esx_srvc_engn_vs_count encountered an error')
 
 
 
@@ -1162,38 +2387,29 @@ class avi_metrics():
             #tenants = self.avi_request('tenant?page_size=1000','admin')
             vs_dict = {}
             graphite_class_list = []
-            discovered = []
+            discovered = set()
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                virtual_services = self.avi_request('virtualservice?page_size=1000',t['name']).json()
-                if virtual_services['count'] > 0:
-                    for v in virtual_services['results']:
-                        vs_dict[v['uuid']] = v['name'].replace('.','_')
+                for v in self.inventory.get('virtualservice',t['name']):
+                    vs_dict[v['uuid']] = self.clean_name(v['name'])
             for t in self.tenants:
-                service_engines = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-                if service_engines['count'] > 0:
-                    for s in service_engines['results']:
+                service_engines = self.inventory.get('serviceengine',t['name'])
+                if len(service_engines) > 0:
+                    for s in service_engines:
                         se_name = s['name']
                         if 'consumers' in s:
                             for e in s['consumers']:
-                                vs_name = vs_dict[e['con_uuid']].replace('.','_')
-                                class graphite_class(): pass
-                                x = graphite_class
-                                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.serviceengine.%s' %(vs_name, se_name)
-                                x.value = 1
-                                if x not in discovered:
-                                    discovered.append(x)
-                                    x.timestamp = int(time.time())
-                                    graphite_class_list.append(x)
+                                vs_name = vs_dict[e['con_uuid']]
+                                name_space = self.namespace('virtualservice', vs_name, 'serviceengine', se_name)
+                                if name_space not in discovered:
+                                    discovered.add(name_space)
+                                    graphite_class_list.append(graphite_sample(name_space, 1, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func virtual_service_hosted_se completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('func virtual_service_hosted_se completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func virtual_service_hosted_se encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func virtual_service_hosted_se encountered an error')
 
 
 
@@ -1208,17 +2424,13 @@ class avi_metrics():
             if lic_cores != None:
                 cores_used = licensing['num_se_vcpus']
                 percentage_used = (cores_used / float(lic_cores))*100
-                name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.licensing.licensed_cores'
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.licensing.licensed_cores', lic_cores, int(time.time()))
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.licensing.cores_used', cores_used, int(time.time()))
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.licensing.percentage_used', percentage_used, int(time.time()))
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func license_usage completed, executed in '+temp_total_time+' seconds')
+                graphite.send(self.namespace('licensing', 'licensed_cores'), lic_cores, int(time.time()))
+                graphite.send(self.namespace('licensing', 'cores_used'), cores_used, int(time.time()))
+                graphite.send(self.namespace('licensing', 'percentage_used'), percentage_used, int(time.time()))
+                self.log.info('func license_usage completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func license_usage encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func license_usage encountered an error')
 
 
 
@@ -1230,16 +2442,16 @@ class avi_metrics():
             temp_start_time = time.time()
             graphite_class_list = []
             se_group_max_vs = {}
-            discovered_vs = []
+            discovered_vs = set()
             se_dict = {}
             for t in self.tenants:
-                se_groups = self.avi_request('serviceenginegroup',t['name']).json()['results']
+                se_groups = self.inventory.get('serviceenginegroup',t['name'])
                 for g in se_groups:
                     se_group_max_vs[g['url']] = float(g['max_vs_per_se'])
             for t in self.tenants:
-                service_engines = self.avi_request('serviceengine?page_size=1000',t['name']).json()
-                if service_engines['count'] > 0:
-                    for s in service_engines['results']:
+                service_engines = self.inventory.get('serviceengine',t['name'])
+                if len(service_engines) > 0:
+                    for s in service_engines:
                         se_name = s['name']
                         if se_name not in se_dict:
                             max_vs = se_group_max_vs[s['se_group_ref']]
@@ -1247,25 +2459,17 @@ class avi_metrics():
                         if 'consumers' in s:
                             for v in s['consumers']:
                                 if se_name+v['con_uuid'] not in discovered_vs:
-                                    discovered_vs.append(s['name']+v['con_uuid'])
+                                    discovered_vs.add(s['name']+v['con_uuid'])
                                     se_dict[se_name]['total_vs'] += 1
             for entry in se_dict:
                 vs_percentage_used = (se_dict[entry]['total_vs']/se_dict[entry]['max_vs'])*100
-                class graphite_class(): pass
-                x = graphite_class
-                x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.vs_capacity_used' %entry
-                x.value = vs_percentage_used
-                x.timestamp = int(time.time())
-                graphite_class_list.append(x)
+                graphite_class_list.append(graphite_sample(self.namespace('serviceengine', entry, 'vs_capacity_used'), vs_percentage_used, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func service_engine_vs_capacity completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('func service_engine_vs_capacity completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func service_engine_vs_capacity encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func service_engine_vs_capacity encountered an error')
 
 
 
@@ -1292,39 +2496,25 @@ class avi_metrics():
             vm_metric_list = ','.join(vm_metric_list)
             se_vmid_dict = {}
             graphite_class_list = []
-            loop = True
-            page_number = 1
-            while loop == True:
-                vmruntime = self.avi_request('vimgrvmruntime?page_size=1000&page='+str(page_number),'admin').json()
-                if vmruntime['count'] > 0:
-                    for v in vmruntime['results']:
-                        if v['vcenter_vAppName'] == 'Avi Service Engine':
-                            se_vmid = v['url'].rsplit('vimgrvmruntime/')[1]
-                            se_vmid_dict[se_vmid] = v['name']
-                    vm_stats = self.avi_request('analytics/metrics/virtualmachine/?metric_id=%s&page_size=1000&limit=1&step=300' %vm_metric_list,'admin').json()
-                    for v in vm_stats['results']:
-                        se_name = se_vmid_dict[v['entity_uuid']]
-                        for entry in v['series']:
-                            class graphite_class(): pass #----- class will be used to create a list for optimized graphite metric sending
-                            metric_name = entry['header']['name'].replace('.','_')
-                            metric_value = entry['data'][0]['value']
-                            x = graphite_class
-                            x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualmachine.%s.%s' %(se_name, metric_name)
-                            x.value = metric_value
-                            x.timestamp = int(time.time())
-                            graphite_class_list.append(x)
-                    page_number +=1
-                else:
-                    loop = False
+            for v in self.avi_paginate('vimgrvmruntime','admin'):
+                if v['vcenter_vAppName'] == 'Avi Service Engine':
+                    se_vmid = v['url'].rsplit('vimgrvmruntime/')[1]
+                    se_vmid_dict[se_vmid] = v['name']
+            if len(se_vmid_dict) > 0:
+                for v in self.avi_paginate('analytics/metrics/virtualmachine/?metric_id=%s&limit=1&step=300' %vm_metric_list,'admin'):
+                    if v['entity_uuid'] not in se_vmid_dict:
+                        continue
+                    se_name = se_vmid_dict[v['entity_uuid']]
+                    for entry in v['series']:
+                        metric_name = self.clean_name(entry['header']['name'])
+                        metric_value = entry['data'][0]['value']
+                        graphite_class_list.append(graphite_sample(self.namespace('virtualmachine', se_name, metric_name), metric_value, int(time.time())))
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func service_engine_vm_stats completed, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+                self.log.info('func service_engine_vm_stats completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func service_engine_vm_stats encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func service_engine_vm_stats encountered an error')
 
 
     #-----------------------------------
@@ -1335,21 +2525,18 @@ class avi_metrics():
             #tenants = self.avi_request('tenant?page_size=1000','admin')
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                virtual_services = self.avi_request('virtualservice?page_size=1000',t['name']).json()
-                if virtual_services['count'] >0:
-                    for v in virtual_services['results']:
+                virtual_services = self.inventory.get('virtualservice',t['name'])
+                if len(virtual_services) >0:
+                    for v in virtual_services:
                         if 'analytics_policy' in v.keys():
                             if 'full_client_logs' in v['analytics_policy'].keys():
                                 if v['analytics_policy']['full_client_logs']['enabled'] == True:
                                     vs_full_log_count += 1 #---- NOT USING, can cleanup
-                                    send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.full_client_logs' %v['name'].replace('.','_'), 1, int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func full_client_log_check completed, executed in '+temp_total_time+' seconds')
+                                    graphite.send(self.namespace('virtualservice', self.clean_name(v['name']), 'full_client_logs'), 1, int(time.time()))
+            self.log.info('func full_client_log_check completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func full_client_log_check encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func full_client_log_check encountered an error')
 
 
     #-----------------------------------
@@ -1359,40 +2546,30 @@ class avi_metrics():
             #tenants = self.avi_request('tenant?page_size=1000','admin')
             #for t in tenants.json()['results']:
             for t in self.tenants:
-                virtual_services = self.avi_request('debugvirtualservice?page_size=1000',t['name']).json()
-                if virtual_services['count'] >0:
-                    for v in virtual_services['results']:
-                        if 'flags' in v.keys():
-                            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.debug_enabled' %v['name'].replace('.','_'), 1, int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': func debug_vs_check completed, executed in '+temp_total_time+' seconds')
+                for v in self.avi_paginate('debugvirtualservice',t['name']):
+                    if 'flags' in v.keys():
+                        graphite.send(self.namespace('virtualservice', self.clean_name(v['name']), 'debug_enabled'), 1, int(time.time()))
+            self.log.info('func debug_vs_check completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func debug_vs_check encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func debug_vs_check encountered an error')
 
 
     #-----------------------------------
     def debug_se_check(self):
         try:
             temp_start_time = time.time()
-            discovered_ses = []
+            discovered_ses = set()
             for t in self.tenants:
-                service_engines = self.avi_request('debugserviceengine?page_size=1000',t['name']).json()
-                if service_engines['count'] >0:
-                    for s in service_engines['results']:
-                        if s['name'] not in discovered_ses:
-                            discovered_ses.append(s['name'])
-                            if 'flags' in s.keys():
-                                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.serviceengine.%s.debug_enabled' %s['name'], 1, int(time.time()))
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func debug_vs_check completed, executed in '+temp_total_time+' seconds')
+                for s in self.avi_paginate('debugserviceengine',t['name']):
+                    if s['name'] not in discovered_ses:
+                        discovered_ses.add(s['name'])
+                        if 'flags' in s.keys():
+                            graphite.send(self.namespace('serviceengine', s['name'], 'debug_enabled'), 1, int(time.time()))
+                self.log.info('func debug_vs_check completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func debug_vs_check encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func debug_vs_check encountered an error')
 
 
     #-----------------------------------
@@ -1400,36 +2577,38 @@ class avi_metrics():
         try:
             temp_start_time = time.time()
             esx_host_core = {}
-            seg = self.avi_request('serviceenginegroup','admin').json()['results']
+            seg = self.inventory.get('serviceenginegroup','admin')
             for g in seg:
                 if 'vcenter_clusters' in g:
                     for v in g['vcenter_clusters']['cluster_refs']:
-                        r1 = self.avi_request(v.split('api/')[1],'admin').json()
-                        for h in r1['host_refs']:
-                            r2 = self.avi_request(h.split('api/')[1],'admin').json()
-                            esx_name = r2['name'].replace('.','_')
+                        r1 = self.esx.cluster(v)
+                        if r1 == None:
+                            continue
+                        for h in r1.get('host_refs', []):
+                            r2 = self.esx.host(h)
+                            if r2 == None:
+                                continue
+                            esx_name = self.clean_name(r2['name'])
                             cpu_cores = r2['num_cpu_cores']
-                            if h not in esx_host_core:
+                            if r2['uuid'] not in esx_host_core:
                                 temp_dict = {}
                                 temp_dict['name'] = esx_name
                                 temp_dict['total_cpu_cores'] = cpu_cores
                                 temp_dict['se_cpu_cores'] = 0
-                                esx_host_core[h] = temp_dict
+                                esx_host_core[r2['uuid']] = temp_dict
             if len(esx_host_core) > 1:
-                se = self.avi_request('serviceengine','admin').json()['results']
+                se = self.inventory.get('serviceengine','admin')
                 for s in se:
-                    esx_host_core[s['host_ref']]['se_cpu_cores'] += s['resources']['num_vcpus']
+                    if 'host_ref' in s and ref_uuid(s['host_ref']) in esx_host_core:
+                        esx_host_core[ref_uuid(s['host_ref'])]['se_cpu_cores'] += s['resources']['num_vcpus']
                 if len(esx_host_core) > 0:
                     for entry in esx_host_core:
-                        send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.esx.%s.total_cpu_cores' %esx_host_core[entry]['name'], esx_host_core[entry]['total_cpu_cores'], int(time.time()))
-                        send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.esx.%s.se_cpu_cores' %esx_host_core[entry]['name'], esx_host_core[entry]['se_cpu_cores'], int(time.time()))
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func esx_core_usage completed, executed in '+temp_total_time+' seconds')
+                        graphite.send(self.namespace('esx', esx_host_core[entry]['name'], 'total_cpu_cores'), esx_host_core[entry]['total_cpu_cores'], int(time.time()))
+                        graphite.send(self.namespace('esx', esx_host_core[entry]['name'], 'se_cpu_cores'), esx_host_core[entry]['se_cpu_cores'], int(time.time()))
+                self.log.info('func esx_core_usage completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func esx_core_usage encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func esx_core_usage encountered an error')
 
 
     #-----------------------------------
@@ -1445,46 +2624,33 @@ class avi_metrics():
                 except:
                     expires = datetime.strptime(l['valid_until'],"%Y-%m-%dT%H:%M:%S")
                 days_to_expire = (expires - current_time).days
-                send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.licensing.expiration_days.'+license_id, days_to_expire, int(time.time()))
-            temp_total_time = str(time.time()-temp_start_time)
-            print(str(datetime.now())+' '+self.avi_controller+': func license_expiration completed, executed in '+temp_total_time+' seconds')
+                graphite.send(self.namespace('licensing', 'expiration_days', license_id), days_to_expire, int(time.time()))
+            self.log.info('func license_expiration completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func license_expiration encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func license_expiration encountered an error')
 
 
 
     #-----------------------------------
-    #----- CHECK FOR % OF SIGNIFICANT LOGS PER POOL MEMBER FOR PAST 5 MINUTES, Only Runs every 5 mins
+    #----- CHECK FOR % OF SIGNIFICANT LOGS PER POOL MEMBER FOR PAST 5 MINUTES
     def pool_member_sig_logs_threaded(self):
         try:
-            if (datetime.now().minute)%5 == 0:
-                temp_start_time = time.time()
-                #tenants = self.avi_request('tenant?page_size=1000','admin').json()['results']
-                vs_dict = {}
-                #for t in tenants:
-                for t in self.tenants:
-                    vs_list = []
-                    virtual_services = self.avi_request('virtualservice?page_size=1000',t['name']).json()
-                    for vs in virtual_services['results']:
-                        vs_list.append(vs)
-                    vs_dict[t['name']] = vs_list
-                proc = []
-                for k in vs_dict:
-                    for v in vs_dict[k]:
-                        p = Process(target = self.pool_member_sig_logs, args = (k,v,))
-                        p.start()
-                        proc.append(p)
-                for p in proc:
-                    p.join()
-                temp_total_time = str(time.time()-temp_start_time)
-                if args.debug == True:
-                    print(str(datetime.now())+' '+self.avi_controller+': func pool_member_sig_logs_threaded completed, executed in '+temp_total_time+' seconds')
+            temp_start_time = time.time()
+            #tenants = self.avi_request('tenant?page_size=1000','admin').json()['results']
+            vs_dict = {}
+            #for t in tenants:
+            for t in self.tenants:
+                vs_dict[t['name']] = self.inventory.get('virtualservice',t['name'])
+            vs_tasks = []
+            for k in vs_dict:
+                for v in vs_dict[k]:
+                    vs_tasks.append((k,v))
+            scheduler.map(lambda task: self.pool_member_sig_logs(task[0],task[1]), vs_tasks)
+            self.log.info('func pool_member_sig_logs_threaded completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': pool_member_sig_logs_threaded encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('pool_member_sig_logs_threaded encountered an error')
 
 
     #-----------------------------------
@@ -1501,19 +2667,13 @@ class avi_metrics():
                     if not entry['value']:
                         pass
                     else:
-                        class graphite_class(): pass
-                        pool_member = entry['value'].replace('.','_')
-                        x = graphite_class
-                        x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.pool_member_sig_logs.%s' %(vs_name.replace('.','_'), pool_member)
-                        x.value = entry['percentage']
-                        x.timestamp = int(time.time())
-                        graphite_class_list.append(x)
+                        pool_member = self.clean_name(entry['value'])
+                        graphite_class_list.append(graphite_sample(self.namespace('virtualservice', self.clean_name(vs_name), 'pool_member_sig_logs', pool_member), entry['percentage'], int(time.time())))
                 if len(graphite_class_list) > 0:
-                    send_class_list_graphite(graphite_class_list)
+                    graphite.send_list(graphite_class_list)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': pool_member_sig_logs '+vs['name']+' encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('pool_member_sig_logs %s encountered an error', vs['name'])
 
 
 
@@ -1526,16 +2686,11 @@ class avi_metrics():
             temp_start_time = time.time()
             #current_version = self.avi_request('version/controller', 'admin').json()[0]['version'].split(' ',1)[0].split('(',1)[0].replace('.','_')
             current_version = self.avi_request('version/controller', 'admin').json()[0]['version'].split(' ',1)[0].replace('.','_')
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.current_version.%s' %current_version, 1, int(time.time()))
-            temp_name = 'network-script.avi.sc.lab.10_130_163_188.current_version.16_4_3(8972)'
-            #send_value_graphite(temp_name,1,int(time.time()))
-            if args.debug == True:
-                temp_total_time = str(time.time()-temp_start_time)
-                print(str(datetime.now())+' '+self.avi_controller+': func get_avi_version completed, executed in '+temp_total_time+' seconds')
+            graphite.send(self.namespace('current_version', current_version), 1, int(time.time()))
+            self.log.info('func get_avi_version completed, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': get_avi_version encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('get_avi_version encountered an error')
 
 
 
@@ -1545,72 +2700,33 @@ class avi_metrics():
     def pool_server_metrics(self):
         try:
             temp_start_time = time.time()
-            pool_server_metric_list = [
-                'l4_server.max_rx_pkts_absolute',
-                'l4_server.avg_rx_pkts',
-                'l4_server.max_tx_pkts_absolute',
-                'l4_server.avg_tx_pkts',
-                'l4_server.max_rx_bytes_absolute',
-                'l4_server.max_tx_bytes_absolute',
-                'l4_server.avg_bandwidth',
-                'l7_server.avg_complete_responses',
-                'l4_server.avg_new_established_conns',
-                'l4_server.avg_pool_open_conns',
-                'l4_server.avg_pool_complete_conns',
-                'l4_server.avg_open_conns',
-                'l4_server.max_open_conns']
-            pool_server_metric_list = ','.join(pool_server_metric_list)
             graphite_class_list = []
-            discovered_servers = [] #--- this is used b/c members in admin show up in other tenants
+            discovered_servers = set() #--- this is used b/c members in admin show up in other tenants
             #tenants = self.avi_request('tenant?page_size=1000','admin')
             try:
                 #for t in tenants.json()['results']:
                 for t in self.tenants:
-                    payload = {
-                        "metric_requests": [
-                            {
-                                #"start": "2017-09-18T20:20:00.000Z",
-                                "step": 300,
-                                "limit": 1,
-                                "aggregate_entity": False,
-                                "entity_uuid": "*",
-                                "obj_id": "*",
-                                "pool_uuid": "*",
-                                "id": "collItemRequest:AllServers",
-                                "metric_id": pool_server_metric_list
-                            }
-                            ]}
-                    api_url = 'analytics/metrics/collection?pad_missing_data=false&dimension_limit=1000&include_name=true&include_refs=true'
-                    resp = self.avi_post(api_url,t['name'],payload)
-                    if len(resp.json()['series']['collItemRequest:AllServers']) != 0:
-                        for p in resp.json()['series']['collItemRequest:AllServers']:
+                    resp = self.metric_queries.get(t['name'], 'AllServers', params=pool_server_params)
+                    if len(resp) != 0:
+                        for p in resp:
                             if p not in discovered_servers:
-                                discovered_servers.append(p)
+                                discovered_servers.add(p)
                                 server_object = p.split(',')[2]
-                                for d in resp.json()['series']['collItemRequest:AllServers'][p]:
+                                for d in resp[p]:
                                     if 'data' in d:
                                         pool_name = d['header']['pool_ref'].rsplit('#',1)[1]
                                         vs_name = d['header']['entity_ref'].rsplit('#',1)[1]
-                                        metric_name = d['header']['name'].replace('.','_')
-                                        class graphite_class(): pass
-                                        x = graphite_class
-                                        x.name_space = 'network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.virtualservice.%s.pool.%s.%s.%s' %(vs_name.replace('.','_'), pool_name.replace('.','_'), server_object.replace('.','_'),metric_name)
-                                        x.value = d['data'][0]['value']
-                                        x.timestamp = int(time.time())
-                                        graphite_class_list.append(x)
+                                        metric_name = self.clean_name(d['header']['name'])
+                                        graphite_class_list.append(graphite_sample(self.namespace('virtualservice', self.clean_name(vs_name), 'pool', self.clean_name(pool_name), self.clean_name(server_object), metric_name), d['data'][0]['value'], int(time.time())))
             except:
-                print(str(datetime.now())+' '+self.avi_controller+': func pool_server_metrics encountered an error for tenant '+t['name'])
-                exception_text = traceback.format_exc()
-                print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+                self.stats.record_error()
+                self.log.exception('func pool_server_metrics encountered an error for tenant %s', t['name'])
             if len(graphite_class_list) > 0:
-                send_class_list_graphite(graphite_class_list)
-            temp_total_time = str(time.time()-temp_start_time)
-            if args.debug == True:
-                print(str(datetime.now())+' '+self.avi_controller+': pool_server_metrics, executed in '+temp_total_time+' seconds')
+                graphite.send_list(graphite_class_list)
+            self.log.info('pool_server_metrics, executed in %s seconds', time.time()-temp_start_time)
         except:
-            print(str(datetime.now())+' '+self.avi_controller+': func pool_server_metrics encountered an error encountered an error')
-            exception_text = traceback.format_exc()
-            print(str(datetime.now())+' '+self.avi_controller+': '+exception_text)
+            self.stats.record_error()
+            self.log.exception('func pool_server_metrics encountered an error encountered an error')
 
 
 
@@ -1623,10 +2739,23 @@ class avi_metrics():
     #----- This is the method within the class that will execute the other methods.
     #----- all test methods will need to be added to test_functions list to be executed
     def gather_metrics(self):
+        self.stats = cycle_stats()
+        self.stats.run('gather_metrics', self._gather_metrics)
+        for collector, message, count in self.stats.repeated_logs():
+            self.log.warning('%s: %d more messages like "%s" were not logged this cycle', collector, count, message)
+
+
+    def _gather_metrics(self):
         try:
             start_time = time.time()
-            self.login = self.avi_login()
-            self.tenants = self.login.json()['tenants']
+            with self.endpoint_lock:
+                self.resolve_endpoint()
+            self.avi_session()
+            self.inventory.new_cycle()
+            #----- the tenant list is fetched every cycle, a cached login can
+            #----- be older than tenants added since
+            self.tenants = self.inventory.get('tenant','admin')
+            self.clean_names = {}
             #-----------------------------------
             #----- Add Test functions to list for threaded execution
             #-----------------------------------
@@ -1660,34 +2789,98 @@ class avi_metrics():
             test_functions.append(self.pool_server_metrics)
             #test_functions.append(self.pool_member_sig_logs_threaded)
             #test_functions.append(self.service_engine_vm_stats)
+            test_functions = [f for f in test_functions if self.collector_due(f.__name__, start_time)]
+            self.plan_metric_queries([f.__name__ for f in test_functions])
             #-----------------------------------
             #-----------------------------------
             #-----
             #-----------------------------------
             #----- BEGIN Running Test Functions
             #-----------------------------------
-            proc = []
-            for f in test_functions:
-                p = Process(target = f, args = ())
-                p.start()
-                proc.append(p)
-            for p in proc:
-                p.join()
+            scheduler.map(lambda f: self.stats.run(f.__name__, f), test_functions)
             #-----------------------------------
             #-----
             #-----------------------------------
             #----- Log time it took to execute script
             #-----------------------------------
-            total_time = str(time.time()-start_time)
-            print(str(datetime.now())+' '+self.avi_controller+': controller specific tests have completed, executed in '+total_time+' seconds')
-            send_value_graphite('network-script.avi.'+self.host_location+'.'+self.host_environment+'.'+self.avi_controller.replace('.','_')+'.metricscript.executiontime', float(total_time)*1000, int(time.time()))
+            total_time = time.time()-start_time
+            self.log.info('controller specific tests have completed, executed in %s seconds', total_time)
+            graphite.send(self.namespace('metricscript', 'executiontime'), total_time*1000, int(time.time()))
+            self.publish_stats()
+        except:
+            self.stats.record_error()
+            self.log.error('Unable to login to: %s', self.avi_controller)
+        if report_dir != None:
+            self.write_report()
+
+
+    #----- Sends the instrumentation of this cycle under
+    #----- metricscript.collectors.<collector>
+    def publish_stats(self):
+        timestamp = int(time.time())
+        graphite_class_list = []
+        with self.stats.lock:
+            collectors = [(name, dict(c)) for name, c in self.stats.collectors.items()]
+        for name, c in collectors:
+            for key in ('wall_time', 'api_calls', 'api_errors', 'response_bytes', 'samples', 'errors'):
+                graphite_class_list.append(graphite_sample(self.namespace('metricscript', 'collectors', name, key), c[key], timestamp))
+            for i, count in enumerate(c['api_latency']):
+                if i < len(latency_buckets):
+                    bucket = 'le_%d' %latency_buckets[i]
+                else:
+                    bucket = 'le_inf'
+                graphite_class_list.append(graphite_sample(self.namespace('metricscript', 'collectors', name, 'api_latency', bucket), count, timestamp))
+        graphite.send_list(graphite_class_list)
+
+
+    #----- JSON report of the last cycle, one file per controller that is
+    #----- replaced every cycle
+    def write_report(self):
+        try:
+            with self.stats.lock:
+                report = {
+                    'controller': self.avi_controller,
+                    'cycle_start': self.stats.start_time,
+                    'cycle_time': time.time() - self.stats.start_time,
+                    'latency_buckets_ms': latency_buckets,
+                    'collectors': self.stats.collectors}
+                data = json.dumps(report, indent=1, sort_keys=True)
+            report_file = os.path.join(report_dir, 'avi_metrics_report_'+self.avi_controller.replace(':','_')+'.json')
+            temp_file = report_file + '.' + str(os.getpid())
+            with open(temp_file, 'w') as rf:
+                rf.write(data)
+            os.rename(temp_file, report_file)
         except:
-            print('Unable to login to: '+self.avi_controller)
+            self.log.exception('unable to write cycle report')
+
+
+    #----- Queues the tenant wide analytics requests of the collectors that run
+    #----- this cycle, each tenant is then queried with one collection call.
+    def plan_metric_queries(self, collectors):
+        self.metric_queries.new_cycle()
+        for t in self.tenants:
+            if 'srvc_engn_stats' in collectors:
+                self.metric_queries.add(t['name'], 'AllSEs', {'limit': 1, 'aggregate_entity': False, 'entity_uuid': '*', 'se_uuid': '*', 'metric_id': self.se_metric_list}, steps=(300,60))
+            if 'virtual_service_stats_threaded' in collectors:
+                self.metric_queries.add(t['name'], 'allvs', {'limit': 1, 'entity_uuid': '*', 'metric_id': self.vs_metric_list}, steps=(300,60))
+            if 'pool_server_metrics' in collectors:
+                self.metric_queries.add(t['name'], 'AllServers', {'limit': 1, 'aggregate_entity': False, 'entity_uuid': '*', 'obj_id': '*', 'pool_uuid': '*', 'metric_id': self.pool_server_metric_list}, params=pool_server_params)
 
 
     #--- THIS METHOD KICKS OFF THE EXECUTION
+    #--- a cycle that is still running when the next one is due is not
+    #--- started a second time, the overlapping cycle is skipped
     def run(self):
-        self.gather_metrics()
+        if self.cycle_lock.acquire(False) == False:
+            self.log.warning('previous cycle is still running, skipping this cycle')
+            return
+        try:
+            self.gather_metrics()
+            graphite.flush()
+            if exporter != None:
+                exporter.publish(self.metric_prefix, self.stats)
+        finally:
+            self.cycle_lock.release()
 
 
 
@@ -1696,6 +2889,11 @@ class avi_metrics():
     #-----------------------------------
 
 
+#--- avi_metrics objects are kept between runs in docker mode so the inventory
+#--- cache survives from one cycle to the next, keyed by controller config
+avi_controller_objects = {}
+
+
 #--- Primary function to execute the metrics gathering
 #--- This function will create a avi_metrics object for each controller
 #--- and kick off the metrics gathering for them.
@@ -1708,19 +2906,53 @@ def main():
     #        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%b %d %H:%M:%S',filename=log_file,level=logging.DEBUG)
     #    else:
     #        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s', datefmt='%b %d %H:%M:%S',filename=log_file,level=logging.ERROR)
-    proc = []
+    controllers = controller_objects()
+    scheduler.map(lambda c: c.run(), controllers)
+    graphite.close()
+    script_log.info('metric script has completed, executed in %s seconds', time.time()-start_time)
+
+
+
+#--- Returns the avi_metrics object of every configured controller, objects
+#--- of controllers that were removed from the config are dropped
+def controller_objects():
+    controllers = []
     for entry in avi_controller_list:
-        avi_controller = entry['avi_controller']
-        host_location = entry['location']
-        host_environment = entry['environment']
-        c = avi_metrics(avi_controller, host_location, host_environment, entry['avi_user'], base64.b64decode(entry['avi_pass']))
-        p = Process(target = c.run, args = ())
-        p.start()
-        proc.append(p)
-    for p in proc:
-        p.join()
-    total_time = str(time.time()-start_time)
-    print('AVI_SCRIPT: metric script has completed, executed in '+total_time+' seconds')
+        entry_key = json.dumps(entry, sort_keys=True)
+        if entry_key not in avi_controller_objects:
+            avi_controller = entry['avi_controller']
+            host_location = entry['location']
+            host_environment = entry['environment']
+            pool_size = entry.get('pool_size', http_pool_size)
+            avi_controller_objects[entry_key] = avi_metrics(avi_controller, host_location, host_environment, entry['avi_user'], base64.b64decode(entry['avi_pass']), pool_size, entry.get('cluster'))
+        controllers.append(avi_controller_objects[entry_key])
+    for entry_key in list(avi_controller_objects.keys()):
+        if avi_controller_objects[entry_key] not in controllers:
+            del avi_controller_objects[entry_key]
+    return controllers
+
+
+
+#--- Docker mode, every controller runs on its own cycle.  The loop wakes up
+#--- for the next controller that is due and starts its cycle in the
+#--- background so a slow controller does not delay the others.  Also used
+#--- outside docker when the prometheus exporter is enabled.
+def run_forever():
+    global avi_controller_list
+    while True:
+        with open(controllers_file) as amc:
+            avi_controller_list = json.load(amc)['controllers']
+        now = time.time()
+        controllers = controller_objects()
+        if exporter != None:
+            exporter.retain([c.metric_prefix for c in controllers])
+        for c in controllers:
+            if c.cycle_due(now) == True:
+                t = threading.Thread(target=c.run)
+                t.daemon = True
+                t.start()
+        next_cycle = min([c.next_cycle() for c in controllers] or [now + cycle_interval])
+        time.sleep(max(next_cycle - time.time(), 1))
 
 
 
@@ -1731,21 +2963,42 @@ def main():
 #----- check for docker environment Variable
 #----- if docker environment, runs as while loop
 if 'EN_DOCKER' in os.environ:
-    #----- Metrics db server
-    graphite_server = (os.environ['EN_GRAPHITE_SERVER'])
-    if 'EN_GRAPHITE_PORT' in os.environ:
-        graphite_port = int(os.environ['EN_GRAPHITE_PORT'])
-    else:
-        graphite_port = 2003
-    while True:
-        loop_start_time = time.time()
-        with open('avi_controllers.json') as amc:
-            avi_controller_list = json.load(amc)['controllers']
-        main()
-        loop_total_time = time.time()-loop_start_time
-        if loop_total_time < 60:
-            print('AVI_SCRIPT: sleeping for '+str(60 - datetime.now().second)+' seconds')
-            time.sleep(60 - datetime.now().second)
+    #----- Metrics db server, graphite is optional when the prometheus
+    #----- exporter is enabled
+    prometheus_port = args.prometheus_port or int(os.environ.get('EN_PROMETHEUS_PORT', 0))
+    graphite = None
+    if 'EN_GRAPHITE_SERVER' in os.environ or prometheus_port == 0:
+        graphite_server = (os.environ['EN_GRAPHITE_SERVER'])
+        if 'EN_GRAPHITE_PORT' in os.environ:
+            graphite_port = int(os.environ['EN_GRAPHITE_PORT'])
+        else:
+            graphite_port = 2003
+        graphite = graphite_sender(graphite_server, graphite_port,
+            batch_size = int(os.environ.get('EN_GRAPHITE_BATCH_SIZE', 500)),
+            flush_interval = float(os.environ.get('EN_GRAPHITE_FLUSH_INTERVAL', 5)),
+            protocol = os.environ.get('EN_GRAPHITE_PROTOCOL', 'plaintext'),
+            spool_file = os.environ.get('EN_GRAPHITE_SPOOL', 'graphite_spool.txt'),
+            max_buffer = int(os.environ.get('EN_GRAPHITE_MAX_BUFFER', 100000)),
+            replay_rate = int(os.environ.get('EN_GRAPHITE_REPLAY_RATE', 5000)))
+    exporter = None
+    if prometheus_port != 0:
+        exporter = prometheus_exporter(prometheus_port, forward=graphite)
+        graphite = exporter
+    scheduler = task_scheduler(args.workers or int(os.environ.get('EN_MAX_WORKERS', 16)))
+    http_pool_size = int(os.environ.get('EN_HTTP_POOL_SIZE', 8))
+    session_cache = avi_session_cache(os.environ.get('EN_SESSION_CACHE'))
+    dns_cache = reverse_dns_cache(os.environ.get('EN_DNS_CACHE'),
+        ttl = float(os.environ.get('EN_DNS_TTL', 3600)),
+        negative_ttl = float(os.environ.get('EN_DNS_NEGATIVE_TTL', 300)),
+        wait = float(os.environ.get('EN_DNS_WAIT', 5)))
+    leader_cache = avi_session_cache(os.environ.get('EN_LEADER_CACHE'))
+    leader_ttl = float(os.environ.get('EN_LEADER_TTL', 300))
+    leader_probe_timeout = float(os.environ.get('EN_LEADER_PROBE_TIMEOUT', 5))
+    cycle_jitter = float(os.environ.get('EN_CYCLE_JITTER', 20))
+    report_dir = args.report_dir or os.environ.get('EN_REPORT_DIR')
+    aligned_schedule = False
+    controllers_file = 'avi_controllers.json'
+    run_forever()
 else:
     #----- Get the file path to import controller and graphite json, needed for cron
     fdir = os.path.abspath(os.path.dirname(__file__))
@@ -1754,9 +3007,39 @@ else:
         avi_controller_list = json.load(amc)['controllers']
     if args.test == True:
         avi_controller_list = [avi_controller_list[0]]
-    #----- Import graphite server info from json file
-    with open(os.path.join(fdir,'graphite_host.json')) as gr:
-        graphite_info= json.load(gr)['graphite']
-        graphite_server = graphite_info['server']
-        graphite_port = graphite_info['server_port']
-    main()
+    #----- Import graphite server info from json file, graphite is optional
+    #----- when the prometheus exporter is enabled
+    graphite = None
+    if os.path.exists(os.path.join(fdir,'graphite_host.json')) or args.prometheus_port == None:
+        with open(os.path.join(fdir,'graphite_host.json')) as gr:
+            graphite_info= json.load(gr)['graphite']
+            graphite_server = graphite_info['server']
+            graphite_port = graphite_info['server_port']
+        graphite = graphite_sender(graphite_server, graphite_port,
+            batch_size = graphite_info.get('batch_size', 500),
+            flush_interval = graphite_info.get('flush_interval', 5),
+            protocol = graphite_info.get('protocol', 'plaintext'),
+            spool_file = graphite_info.get('spool_file', os.path.join(fdir,'.graphite_spool.txt')),
+            max_buffer = graphite_info.get('max_buffer', 100000),
+            replay_rate = graphite_info.get('replay_rate', 5000))
+    exporter = None
+    if args.prometheus_port != None:
+        exporter = prometheus_exporter(args.prometheus_port, forward=graphite)
+        graphite = exporter
+    scheduler = task_scheduler(args.workers or 16)
+    http_pool_size = 8
+    session_cache = avi_session_cache(os.path.join(fdir,'.avi_session_cache.json'))
+    dns_cache = reverse_dns_cache(os.path.join(fdir,'.avi_dns_cache.json'))
+    leader_cache = avi_session_cache(os.path.join(fdir,'.avi_leader_cache.json'))
+    leader_ttl = 300
+    leader_probe_timeout = 5
+    cycle_jitter = 0
+    report_dir = args.report_dir
+    controllers_file = os.path.join(fdir,'avi_controllers.json')
+    if exporter != None:
+        #----- the exporter keeps running, every collector runs on the first cycle
+        aligned_schedule = False
+        run_forever()
+    else:
+        aligned_schedule = True
+        main()
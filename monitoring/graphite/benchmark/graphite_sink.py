@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Graphite TCP sink used to benchmark avi-metric-script-graphite.py.
+#
+# Accepts carbon plaintext or pickle connections and counts what is received,
+# nothing is stored.  Plaintext metrics are counted per line, pickle batches
+# are unpickled and counted per metric.  The counters are rewritten to the
+# stats file every second as json.
+
+import argparse
+import json
+import os
+import socket
+import struct
+import threading
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+parser = argparse.ArgumentParser(description='Graphite sink for benchmarking the graphite metric script')
+parser.add_argument('--port', type=int, default=2003, help='TCP port to listen on')
+parser.add_argument('--protocol', choices=['plaintext', 'pickle'], default='plaintext', help='Carbon protocol to expect')
+parser.add_argument('--stats-file', default='graphite_sink_stats.json', help='File the counters are written to')
+args = parser.parse_args()
+
+stats = {'connections': 0, 'metrics': 0, 'bytes': 0}
+stats_lock = threading.Lock()
+
+
+def recv_exact(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_plaintext(conn):
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            return
+        with stats_lock:
+            stats['metrics'] += data.count(b'\n')
+            stats['bytes'] += len(data)
+
+
+def read_pickle(conn):
+    while True:
+        header = recv_exact(conn, 4)
+        if header == None:
+            return
+        payload = recv_exact(conn, struct.unpack('!L', header)[0])
+        if payload == None:
+            return
+        samples = pickle.loads(payload)
+        with stats_lock:
+            stats['metrics'] += len(samples)
+            stats['bytes'] += len(header) + len(payload)
+
+
+def handle(conn):
+    try:
+        if args.protocol == 'pickle':
+            read_pickle(conn)
+        else:
+            read_plaintext(conn)
+    finally:
+        conn.close()
+
+
+def write_stats():
+    while True:
+        time.sleep(1)
+        with stats_lock:
+            data = json.dumps(stats)
+        temp_file = args.stats_file + '.tmp'
+        with open(temp_file, 'w') as stats_file:
+            stats_file.write(data)
+        os.rename(temp_file, args.stats_file)
+
+
+if __name__ == '__main__':
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', args.port))
+    server.listen(128)
+    writer = threading.Thread(target=write_stats)
+    writer.daemon = True
+    writer.start()
+    print('graphite sink listening on 127.0.0.1:%d, %s' % (args.port, args.protocol))
+    while True:
+        conn, addr = server.accept()
+        with stats_lock:
+            stats['connections'] += 1
+        reader = threading.Thread(target=handle, args=(conn,))
+        reader.daemon = True
+        reader.start()
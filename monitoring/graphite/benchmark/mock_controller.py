@@ -0,0 +1,292 @@
+#!/usr/bin/python
+#
+# Stand-in Avi controller used to benchmark avi-metric-script-graphite.py.
+#
+# Serves synthetic responses for every api the metric script calls.  The
+# number of tenants, virtual services and service engines is set on the
+# command line and every response can be delayed to simulate a loaded
+# controller.  Virtual services are spread over the service engines round
+# robin and every metric returned by analytics/metrics/collection has a single
+# data point.
+#
+# The number of requests served per api is returned by GET /_benchmark/counts,
+# this path is not part of the Avi api and is not counted.
+
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+parser = argparse.ArgumentParser(description='Mock Avi controller for benchmarking the graphite metric script')
+parser.add_argument('--port', type=int, default=8443, help='HTTPS port to listen on')
+parser.add_argument('--tenants', type=int, default=2, help='Number of tenants, including admin')
+parser.add_argument('--vs', type=int, default=30, help='Number of virtual services per tenant')
+parser.add_argument('--se', type=int, default=4, help='Number of service engines')
+parser.add_argument('--hosts', type=int, default=3, help='Number of ESX hosts the service engines run on')
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds every request is delayed by')
+parser.add_argument('--cert', help='PEM file with the certificate and key, a self-signed one is generated if not set')
+args = parser.parse_args()
+
+SESSION_ID = 'benchmark-session'
+CSRF_TOKEN = 'benchmark-csrf'
+base_url = 'https://127.0.0.1:%d/api/' % args.port
+counts = {}
+counts_lock = threading.Lock()
+
+
+#----- Fixtures
+tenants = ['admin'] + ['tenant%d' % i for i in range(1, args.tenants)]
+service_engines = []
+for i in range(args.se):
+    service_engines.append({
+        'uuid': 'se-%d' % i,
+        'name': 'se%d.benchmark' % i,
+        'url': base_url + 'serviceengine/se-%d' % i,
+        'se_group_ref': base_url + 'serviceenginegroup/serviceenginegroup-1',
+        'host_ref': base_url + 'vimgrhostruntime/host-%d' % (i % args.hosts),
+        'resources': {'num_vcpus': 2},
+        'hb_status': {'num_hb_misses': 0},
+        'consumers': []})
+virtual_services = {}
+vs_se = {}
+for t in tenants:
+    virtual_services[t] = []
+    for i in range(args.vs):
+        vs_uuid = 'virtualservice-%s-%d' % (t, i)
+        virtual_services[t].append({'uuid': vs_uuid, 'name': '%s-vs%d' % (t, i), 'url': base_url + 'virtualservice/' + vs_uuid, 'tenant': t})
+        if len(service_engines) > 0:
+            se = service_engines[(len(vs_se)) % len(service_engines)]
+            se['consumers'].append({'con_uuid': vs_uuid})
+            vs_se[vs_uuid] = se['uuid']
+hosts = []
+for i in range(args.hosts):
+    hosts.append({
+        'uuid': 'host-%d' % i,
+        'name': 'esx%d.benchmark' % i,
+        'url': base_url + 'vimgrhostruntime/host-%d' % i,
+        'num_cpu_cores': 16,
+        'cluster_ref': base_url + 'vimgrclusterruntime/cluster-%d' % (i % 2),
+        'vm_refs': [base_url + 'vimgrvmruntime/vm-%d' % j for j in range(args.se) if j % args.hosts == i]})
+clusters = []
+for i in range(2):
+    clusters.append({
+        'uuid': 'cluster-%d' % i,
+        'name': 'cluster%d.benchmark' % i,
+        'url': base_url + 'vimgrclusterruntime/cluster-%d' % i,
+        'host_refs': [h['url'] for h in hosts if h['cluster_ref'].endswith('/cluster-%d' % i)]})
+vms = []
+for j, se in enumerate(service_engines):
+    vms.append({
+        'uuid': 'vm-%d' % j,
+        'name': se['name'],
+        'url': base_url + 'vimgrvmruntime/vm-%d' % j,
+        'vcenter_vAppName': 'Avi Service Engine',
+        'host_ref': base_url + 'vimgrhostruntime/host-%d' % (j % args.hosts)})
+
+
+def page(results, query):
+    page_size = int(query.get('page_size', ['25'])[0])
+    page_number = int(query.get('page', ['1'])[0])
+    chunk = results[(page_number - 1) * page_size:page_number * page_size]
+    if page_number > 1 and len(chunk) == 0:
+        return 404, {'error': 'Invalid page'}
+    body = {'count': len(results), 'results': chunk}
+    if page_number * page_size < len(results):
+        body['next'] = base_url + 'next?page=%d&page_size=%d' % (page_number + 1, page_size)
+    return 200, body
+
+
+def metric_series(metric_ids, entity_uuid, entity_name):
+    header_ref = base_url + 'virtualservice/%s#%s' % (entity_uuid, entity_name)
+    return [{'header': {'name': m, 'entity_ref': header_ref, 'pool_ref': base_url + 'pool/pool-%s#%s-pool' % (entity_uuid, entity_name)},
+             'data': [{'value': 1.5, 'timestamp': '2017-01-01T00:00:00+00:00'}]} for m in metric_ids]
+
+
+#----- Answers one metric_requests entry of an analytics/metrics/collection call
+def collection_series(request, tenant):
+    metric_ids = request['metric_id'].split(',')
+    series = {}
+    if request.get('pool_uuid') == '*':
+        for v in virtual_services.get(tenant, []):
+            series['%s,pool-%s,10.0.0.1:80' % (v['uuid'], v['uuid'])] = metric_series(metric_ids, v['uuid'], v['name'])
+    elif request.get('se_uuid') == '*':
+        for se in service_engines:
+            series[se['uuid']] = metric_series(metric_ids, se['uuid'], se['name'])
+    else:
+        for v in virtual_services.get(tenant, []):
+            series[v['uuid']] = metric_series(metric_ids, v['uuid'], v['name'])
+    return series
+
+
+def get_response(path, query, tenant):
+    vs_list = virtual_services.get(tenant, [])
+    if path == 'tenant':
+        return page([{'uuid': 'tenant-' + t, 'name': t, 'url': base_url + 'tenant/tenant-' + t} for t in tenants], query)
+    if path in ('virtualservice', 'debugvirtualservice'):
+        return page(vs_list, query)
+    if path == 'virtualservice-inventory':
+        return page([{'uuid': v['uuid'], 'config': v, 'runtime': {'oper_status': {'state': 'OPER_UP'}}, 'health_score': {'health_score': 90}} for v in vs_list], query)
+    if path in ('serviceengine', 'debugserviceengine'):
+        return page(service_engines, query)
+    if path.startswith('serviceengine/') and path.endswith('/bgp'):
+        return 200, [{'peers': [{'peer_ip': '10.255.0.1', 'bgp_state': 'Established'}]}]
+    if path == 'pool-inventory':
+        return page([{'config': {'name': '%s-pool' % v['name']}, 'virtualservice': {'name': v['name']},
+                      'runtime': {'num_servers': 2, 'num_servers_up': 2, 'num_servers_enabled': 2}} for v in vs_list], query)
+    if path == 'serviceenginegroup':
+        return page([{'url': base_url + 'serviceenginegroup/serviceenginegroup-1', 'name': 'Default-Group', 'max_vs_per_se': 10,
+                      'vcenter_clusters': {'include': True, 'cluster_refs': [c['url'] for c in clusters]}}], query)
+    if path == 'sslkeyandcertificate':
+        return page([{'name': 'benchmark.cert', 'certificate': {'not_after': '2030-01-01 00:00:00'}}], query)
+    if path == 'networkruntime':
+        return page([{'name': 'benchmark-net', 'subnet_runtime': [{'total_ip_count': 254, 'used_ip_count': 10}]}], query)
+    if path == 'cloud':
+        return page([{'name': 'Default-Cloud', 'apic_mode': False}], query)
+    if path == 'cluster/runtime':
+        return 200, {'node_states': [{'name': '127.0.0.1', 'role': 'CLUSTER_LEADER', 'state': 'CLUSTER_ACTIVE'}]}
+    if path == 'vimgrvcenterruntime':
+        return page([{'vcenter_url': '127.0.0.1', 'inventory_state': 'VCENTER_DISCOVERY_COMPLETE', 'vcenter_connected': True}], query)
+    if path == 'vinfra/internal':
+        return 200, [{'vcenter_url': '127.0.0.1', 'datacenters': [{'vm_monitor_list_ver': 1, 'resource_monitor_list_ver': 1}]}]
+    if path == 'vimgrhostruntime':
+        return page(hosts, query)
+    if path.startswith('vimgrhostruntime/'):
+        uuid = path.split('/', 1)[1]
+        return 200, [h for h in hosts if h['uuid'] == uuid][0]
+    if path == 'vimgrclusterruntime':
+        return page(clusters, query)
+    if path.startswith('vimgrclusterruntime/'):
+        uuid = path.split('/', 1)[1]
+        return 200, [c for c in clusters if c['uuid'] == uuid][0]
+    if path == 'vimgrvmruntime':
+        if 'name' in query:
+            return page([vm for vm in vms if vm['name'] == query['name'][0]], query)
+        return page(vms, query)
+    if path.startswith('vimgrvmruntime/'):
+        uuid = path.split('/', 1)[1]
+        return 200, [vm for vm in vms if vm['uuid'] == uuid][0]
+    if path == 'vimgrsevmruntime':
+        return page([], query)
+    if path == 'licenseusage':
+        return 200, {'licensed_cores': 1000, 'num_se_vcpus': 2 * len(service_engines)}
+    if path == 'license':
+        return 200, {'licenses': [{'license_id': 'benchmark', 'valid_until': '2030-01-01 00:00:00'}]}
+    if path == 'version/controller':
+        return 200, [{'version': '17.2.1 (9000)'}]
+    if path == 'analytics/metrics/virtualservice' and query.get('serviceengine_uuid') == ['*']:
+        results = []
+        for v in vs_list:
+            if v['uuid'] in vs_se:
+                series = metric_series(query['metric_id'][0].split(','), v['uuid'], v['name'])
+                for m in series:
+                    m['header'].update({'entity_uuid': v['uuid'], 'serviceengine_uuid': vs_se[v['uuid']]})
+                results.append({'entity_uuid': v['uuid'], 'series': series})
+        return page(results, query)
+    if path == 'analytics/healthscore/serviceengine':
+        return page([{'entity_uuid': se['uuid'], 'series': [{'data': [{'value': 100}]}]} for se in service_engines], query)
+    if path == 'analytics/logs':
+        groupby = query.get('groupby', [None])[0]
+        if groupby == 'virtualservice':
+            status, body = page([{'value': v['uuid'], 'count': 3} for v in vs_list], query)
+            body['percent_remaining'] = 0.0
+            return status, body
+        if groupby != None:
+            return 200, {'count': 1, 'results': [{'value': '10.0.0.1', 'count': 3, 'percentage': 50.0}]}
+        return 200, {'count': 3, 'results': []}
+    return 404, {'error': 'not found: ' + path}
+
+
+class controller_handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *log_args):
+        pass
+
+    def reply(self, code, body, cookies=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for cookie in cookies or []:
+            self.send_header('Set-Cookie', cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def count(self, key):
+        with counts_lock:
+            counts[key] = counts.get(key, 0) + 1
+
+    def authenticated(self):
+        return 'sessionid=' + SESSION_ID in (self.headers.get('Cookie') or '')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        url = urlparse(self.path)
+        self.count('POST ' + url.path)
+        if args.latency > 0:
+            time.sleep(args.latency)
+        if url.path == '/login':
+            cookies = ['sessionid=%s; Path=/' % SESSION_ID, 'csrftoken=%s; Path=/' % CSRF_TOKEN]
+            return self.reply(200, {'tenants': [{'name': t} for t in tenants]}, cookies)
+        if self.authenticated() == False:
+            return self.reply(401, {'detail': 'Authentication credentials were not provided.'})
+        if url.path == '/api/analytics/metrics/collection':
+            tenant = self.headers.get('X-Avi-Tenant') or 'admin'
+            series = {}
+            for request in json.loads(body.decode('utf-8'))['metric_requests']:
+                series[request['id']] = collection_series(request, tenant)
+            return self.reply(200, {'series': series})
+        return self.reply(404, {'error': 'not found: ' + url.path})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/_benchmark/counts':
+            with counts_lock:
+                return self.reply(200, counts)
+        path = url.path[len('/api/'):].rstrip('/')
+        self.count('GET ' + path.split('/')[0])
+        if args.latency > 0:
+            time.sleep(args.latency)
+        if self.authenticated() == False:
+            return self.reply(401, {'detail': 'Authentication credentials were not provided.'})
+        code, body = get_response(path, parse_qs(url.query), self.headers.get('X-Avi-Tenant') or 'admin')
+        return self.reply(code, body)
+
+
+class controller_server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def self_signed_cert():
+    cert_file = os.path.join(tempfile.mkdtemp(), 'mock_controller.pem')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                               '-subj', '/CN=127.0.0.1', '-keyout', cert_file, '-out', cert_file],
+                              stdout=devnull, stderr=devnull)
+    return cert_file
+
+
+if __name__ == '__main__':
+    server = controller_server(('127.0.0.1', args.port), controller_handler)
+    cert_file = args.cert or self_signed_cert()
+    if hasattr(ssl, 'SSLContext'):
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(cert_file)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    else:
+        server.socket = ssl.wrap_socket(server.socket, certfile=cert_file, server_side=True)
+    print('mock controller listening on 127.0.0.1:%d, %d tenants, %d vs per tenant, %d se' % (args.port, len(tenants), args.vs, args.se))
+    server.serve_forever()
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+#
+# Scale benchmark for avi-metric-script-graphite.py.
+#
+# Starts mock_controller.py and graphite_sink.py, copies the metric script to
+# a scratch directory next to an avi_controllers.json and graphite_host.json
+# pointing at them and runs it the way cron does.  For every run the cycle
+# time, peak RSS, forked processes, peak thread count, api calls made and
+# metrics received by the sink are printed.
+#
+# The results can be saved with --output and compared against a saved run
+# with --baseline, the benchmark exits with 1 when cycle time, peak RSS, api
+# calls or forks grew by more than --tolerance percent.
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+fdir = os.path.abspath(os.path.dirname(__file__))
+
+parser = argparse.ArgumentParser(description='Benchmark the graphite metric script against a mock Avi controller')
+parser.add_argument('--tenants', type=int, default=2, help='Number of tenants, including admin')
+parser.add_argument('--vs', type=int, default=30, help='Number of virtual services per tenant')
+parser.add_argument('--se', type=int, default=4, help='Number of service engines')
+parser.add_argument('--latency', type=float, default=0.0, help='Seconds every controller request is delayed by')
+parser.add_argument('--protocol', choices=['plaintext', 'pickle'], default='plaintext', help='Carbon protocol the script sends with')
+parser.add_argument('--runs', type=int, default=1, help='Number of times the script is run')
+parser.add_argument('--controller-port', type=int, default=8443, help='Port of the mock controller')
+parser.add_argument('--graphite-port', type=int, default=2003, help='Port of the graphite sink')
+parser.add_argument('--script', default=os.path.join(fdir, '..', 'avi-metric-script-graphite.py'), help='Metric script to benchmark')
+parser.add_argument('--script-args', default='--brief', help='Arguments passed to the metric script')
+parser.add_argument('--timeout', type=int, default=600, help='Seconds a run may take before it is killed')
+parser.add_argument('--output', help='Write the results to this json file')
+parser.add_argument('--baseline', help='Compare the results to a json file written with --output')
+parser.add_argument('--tolerance', type=float, default=20.0, help='Percent a result may exceed the baseline by')
+args = parser.parse_args()
+
+regression_keys = ['cycle_time', 'peak_rss_kb', 'api_calls', 'forks']
+
+
+def wait_for_port(port, timeout=30):
+    end_time = time.time() + timeout
+    while time.time() < end_time:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise Exception('nothing listening on port %d' % port)
+
+
+def mock_counts():
+    url = 'https://127.0.0.1:%d/_benchmark/counts' % args.controller_port
+    if hasattr(ssl, '_create_unverified_context'):
+        return json.loads(urlopen(url, context=ssl._create_unverified_context()).read().decode('utf-8'))
+    return json.loads(urlopen(url).read().decode('utf-8'))
+
+
+def sink_stats(stats_file):
+    try:
+        with open(stats_file) as sf:
+            return json.load(sf)
+    except (IOError, ValueError):
+        return {'connections': 0, 'metrics': 0, 'bytes': 0}
+
+
+def wait_for_sink(stats_file, timeout=10):
+    #----- the sink writes its counters once a second, wait until they stop changing
+    last = None
+    end_time = time.time() + timeout
+    while time.time() < end_time:
+        time.sleep(1.5)
+        stats = sink_stats(stats_file)
+        if stats == last:
+            break
+        last = stats
+    return last
+
+
+#----- All processes below pid, found by walking /proc
+def descendants(pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() == False:
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat_file:
+                ppid = int(stat_file.read().rsplit(')', 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (IOError, OSError, IndexError, ValueError):
+            pass
+    found = []
+    pending = [pid]
+    while len(pending) > 0:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def thread_count(pid):
+    try:
+        return len(os.listdir('/proc/%d/task' % pid))
+    except OSError:
+        return 0
+
+
+#----- Runs the script once, /proc is sampled while it runs to find forked
+#----- processes and the peak thread count
+def run_script(run_dir, log_file):
+    command = [sys.executable, os.path.join(run_dir, 'avi-metric-script-graphite.py'), '-r', run_dir] + args.script_args.split()
+    start_time = time.time()
+    with open(log_file, 'a') as log:
+        proc = subprocess.Popen(command, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT)
+        forked = set()
+        peak_threads = 0
+        while True:
+            #----- wait4 gives the resource usage of the script alone, the mock
+            #----- and the sink are children too
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid != 0:
+                break
+            peak_threads = max(peak_threads, thread_count(proc.pid))
+            forked.update(descendants(proc.pid))
+            if time.time() - start_time > args.timeout:
+                proc.kill()
+            time.sleep(0.02)
+        wall_time = time.time() - start_time
+    if os.WIFEXITED(status):
+        returncode = os.WEXITSTATUS(status)
+    else:
+        returncode = -os.WTERMSIG(status)
+    proc.returncode = returncode
+    return returncode, wall_time, len(forked), peak_threads, usage.ru_maxrss
+
+
+def compare(results, baseline):
+    regressions = []
+    for key in regression_keys:
+        old = baseline.get(key)
+        new = results.get(key)
+        if old == None or new == None:
+            continue
+        if new > old * (1 + args.tolerance / 100.0) and new - old > 0:
+            regressions.append('%s: %s -> %s' % (key, old, new))
+    return regressions
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='avi_graphite_benchmark_')
+    run_dir = os.path.join(work_dir, 'run')
+    os.mkdir(run_dir)
+    sink_file = os.path.join(work_dir, 'graphite_sink_stats.json')
+    log_file = os.path.join(work_dir, 'benchmark.log')
+    shutil.copy(args.script, os.path.join(run_dir, 'avi-metric-script-graphite.py'))
+    with open(os.path.join(run_dir, 'avi_controllers.json'), 'w') as cf:
+        json.dump({'controllers': [{'avi_controller': '127.0.0.1:%d' % args.controller_port, 'location': 'benchmark',
+                                    'environment': 'benchmark', 'avi_user': 'benchmark', 'avi_pass': 'YmVuY2htYXJr'}]}, cf)
+    with open(os.path.join(run_dir, 'graphite_host.json'), 'w') as gf:
+        json.dump({'graphite': {'server': '127.0.0.1', 'server_port': args.graphite_port, 'protocol': args.protocol}}, gf)
+    log = open(log_file, 'w')
+    servers = [
+        subprocess.Popen([sys.executable, os.path.join(fdir, 'mock_controller.py'), '--port', str(args.controller_port),
+                          '--tenants', str(args.tenants), '--vs', str(args.vs), '--se', str(args.se),
+                          '--latency', str(args.latency)], stdout=log, stderr=subprocess.STDOUT),
+        subprocess.Popen([sys.executable, os.path.join(fdir, 'graphite_sink.py'), '--port', str(args.graphite_port),
+                          '--protocol', args.protocol, '--stats-file', sink_file], stdout=log, stderr=subprocess.STDOUT)]
+    log.close()
+    all_results = []
+    exit_code = 0
+    try:
+        wait_for_port(args.controller_port, timeout=120)
+        wait_for_port(args.graphite_port)
+        time.sleep(0.5)
+        for server in servers:
+            if server.poll() != None:
+                raise Exception('benchmark server exited, is the port already in use? see ' + log_file)
+        print('tenants: %d, vs per tenant: %d, se: %d, latency: %ss, protocol: %s' % (args.tenants, args.vs, args.se, args.latency, args.protocol))
+        for run in range(1, args.runs + 1):
+            api_before = sum(mock_counts().values())
+            metrics_before = sink_stats(sink_file)
+            returncode, wall_time, forks, peak_threads, peak_rss = run_script(run_dir, log_file)
+            sink = wait_for_sink(sink_file)
+            report_file = os.path.join(run_dir, 'avi_metrics_report_127.0.0.1_%d.json' % args.controller_port)
+            with open(report_file) as rf:
+                report = json.load(rf)
+            results = {
+                'run': run,
+                'exit_code': returncode,
+                'cycle_time': round(report['cycle_time'], 3),
+                'wall_time': round(wall_time, 3),
+                'peak_rss_kb': peak_rss,
+                'forks': forks,
+                'peak_threads': peak_threads,
+                'api_calls': sum(mock_counts().values()) - api_before,
+                'api_errors': sum(c['api_errors'] for c in report['collectors'].values()),
+                'collector_errors': sum(c['errors'] for c in report['collectors'].values()),
+                'metrics_received': sink['metrics'] - metrics_before['metrics'],
+                'graphite_connections': sink['connections'] - metrics_before['connections']}
+            all_results.append(results)
+            print('run %(run)d: exit %(exit_code)d, cycle %(cycle_time)ss, wall %(wall_time)ss, peak rss %(peak_rss_kb)d KB, '
+                  'forks %(forks)d, peak threads %(peak_threads)d, api calls %(api_calls)d, api errors %(api_errors)d, '
+                  'collector errors %(collector_errors)d, metrics %(metrics_received)d over %(graphite_connections)d connections' % results)
+            if returncode != 0 or results['collector_errors'] > 0:
+                exit_code = 1
+        print('api calls by endpoint: ' + json.dumps(mock_counts(), sort_keys=True))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+    summary = dict(all_results[-1]) if len(all_results) > 0 else {}
+    summary['runs'] = all_results
+    summary['scale'] = {'tenants': args.tenants, 'vs': args.vs, 'se': args.se, 'latency': args.latency, 'protocol': args.protocol}
+    if args.output:
+        with open(args.output, 'w') as of:
+            json.dump(summary, of, indent=1, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as bf:
+            regressions = compare(summary, json.load(bf))
+        for r in regressions:
+            print('regression: ' + r)
+        if len(regressions) > 0:
+            exit_code = 1
+    if exit_code == 0:
+        shutil.rmtree(work_dir)
+    else:
+        print('run directory and logs kept in ' + work_dir)
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
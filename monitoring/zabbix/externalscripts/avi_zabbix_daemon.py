@@ -0,0 +1,221 @@
+#!/usr/bin/python
+#
+# Resident collector for Zabbix agent items.
+#
+# avi_zabbix_monitor.py starts a new interpreter, logs in and fetches a single
+# value for every item poll.  This daemon keeps one session to the controller
+# open and answers item requests from memory over a local unix socket.  Every
+# item that has been asked for is refreshed in the background, all pending
+# items of the same tenant, entity type and step are fetched together with a
+# single analytics/metrics/collection call.
+#
+# Requests are one line of tab separated fields
+# "tenant entity_type entity_name metric_id [step]", so object names can contain
+# spaces, and are answered with the value or ZBX_NOTSUPPORTED.  A metric that
+# has not been fetched yet is answered with an empty value, its first poll
+# wakes the background refresher instead of fetching within the agent's item
+# timeout.  Items discard the empty value with a preprocessing step, see the
+# README.  A metric the controller rejects is answered with ZBX_NOTSUPPORTED
+# without holding up the other metrics of its group.  The Zabbix agent talks
+# to the daemon through the avi.metric UserParameter in avi_userparameters.conf.
+#
+# -c takes every member of the controller cluster.  The daemon talks to the
+# leader and moves to another member when the leader can no longer be reached.
+
+import argparse
+import os
+import threading
+import time
+import traceback
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+from avi_zabbix_utils import collection_values, get_api_session, get_leader, save_api_session
+from avi.sdk.avi_api import APIError, AviServerError, ObjectNotFound
+import requests
+requests.packages.urllib3.disable_warnings()
+
+parser = argparse.ArgumentParser(description='Daemon used to serve stats from Avi Vantage API to the Zabbix agent')
+parser.add_argument('-c', '--controller', required=True, help='Comma separated IP Addresses of the controllers of the cluster')
+parser.add_argument('-u', '--user', required=True, help='Username to authenticate against Avi Controller')
+parser.add_argument('-p', '--password', required=True, help='Password to authenticate against Avi Controller')
+parser.add_argument('-s', '--socket', default='/tmp/avi_zabbix_daemon.sock', help='Path of the unix socket the daemon listens on')
+parser.add_argument('-i', '--interval', type=int, default=30, help='Seconds between metric refreshes')
+parser.add_argument('--expire', type=int, default=600, help='Seconds after which an item that is no longer polled is dropped')
+args = parser.parse_args()
+
+NOT_SUPPORTED = 'ZBX_NOTSUPPORTED'
+
+
+# True when the controller refused the request itself, ie: a metric_id that
+# does not exist for the entity type, rather than failing to answer it.
+def rejected(error):
+    if isinstance(error, ObjectNotFound):
+        return True
+    return (isinstance(error, APIError) and not isinstance(error, AviServerError) and
+            getattr(error.rsp, 'status_code', None) != 401)
+
+
+class metric_store(object):
+    def __init__(self, leader):
+        self.leader = leader
+        self.api = get_api_session(leader, args.user, args.password)
+        self.lock = threading.Lock()
+        self.failover_lock = threading.Lock()
+        # (tenant, entity_type, step) -> {metric_id: last time it was polled}
+        self.groups = {}
+        # (tenant, entity_type, step) -> lock held while the group is fetched
+        self.group_locks = {}
+        # (tenant, entity_type, step) -> metric_ids of the last fetch
+        self.fetched = {}
+        # (tenant, entity_type, step) -> metric_ids the controller rejected
+        self.rejected = {}
+        # (tenant, entity_type, step, entity_name, metric_id) -> value
+        self.values = {}
+        # set when a new metric is polled, the refresher then fetches the
+        # groups with pending metrics without waiting for the interval
+        self.wakeup = threading.Event()
+
+    def _group_lock(self, group):
+        with self.lock:
+            return self.group_locks.setdefault(group, threading.Lock())
+
+    def get(self, tenant, entity_type, entity_name, metric_id, step):
+        group = (tenant, entity_type, step)
+        key = group + (entity_name, metric_id)
+        with self.lock:
+            metrics = self.groups.setdefault(group, {})
+            is_new = metric_id not in metrics
+            metrics[metric_id] = time.time()
+            pending = metric_id not in self.fetched.get(group, ())
+        if is_new:
+            self.wakeup.set()
+        if pending:
+            return ''
+        with self.lock:
+            return self.values.get(key, NOT_SUPPORTED)
+
+    def fetch(self, entity_type, metrics, step, tenant):
+        api = self.api
+        try:
+            return collection_values(api, entity_type, metrics, step, tenant)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            return collection_values(self.failover(api), entity_type, metrics, step, tenant)
+
+    def refresh_group(self, group):
+        tenant, entity_type, step = group
+        with self._group_lock(group):
+            with self.lock:
+                polled = set(self.groups.get(group, {}).keys())
+                rejected_metrics = self.rejected.setdefault(group, set())
+                metrics = sorted(polled - rejected_metrics)
+            if not polled:
+                return
+            results = {}
+            try:
+                if metrics:
+                    results = self.fetch(entity_type, metrics, step, tenant)
+            except (APIError, ObjectNotFound) as e:
+                if not rejected(e):
+                    raise
+                # fetch the metrics one at a time to find the ones the
+                # controller rejects, they are answered with ZBX_NOTSUPPORTED
+                # and left out of the group fetch from then on
+                for metric_id in metrics:
+                    try:
+                        metric_results = self.fetch(entity_type, [metric_id], step, tenant)
+                    except (APIError, ObjectNotFound) as e:
+                        if not rejected(e):
+                            raise
+                        traceback.print_exc()
+                        with self.lock:
+                            rejected_metrics.add(metric_id)
+                        continue
+                    for obj_name, obj_values in metric_results.items():
+                        results.setdefault(obj_name, {}).update(obj_values)
+            values = {}
+            for obj_name, obj_values in results.items():
+                for metric_id, value in obj_values.items():
+                    values[group + (obj_name, metric_id)] = value
+            with self.lock:
+                for key in [k for k in self.values if k[:3] == group]:
+                    del self.values[key]
+                self.values.update(values)
+                self.fetched[group] = polled
+
+    # Moves to another member of the cluster after api failed to connect.
+    # Groups that fail at the same time only move once, the others pick up
+    # the session of the new leader.
+    def failover(self, api):
+        with self.failover_lock:
+            if self.api is api:
+                leader = get_leader(args.controller, args.user, args.password, exclude=[self.leader])
+                if leader is None:
+                    raise Exception('No valid controllers found')
+                self.leader = leader
+                self.api = get_api_session(leader, args.user, args.password)
+            return self.api
+
+    def expire(self):
+        cutoff = time.time() - args.expire
+        with self.lock:
+            for group in list(self.groups.keys()):
+                metrics = self.groups[group]
+                for metric_id in [m for m in metrics if metrics[m] < cutoff]:
+                    del metrics[metric_id]
+                    self.rejected.get(group, set()).discard(metric_id)
+                if not metrics:
+                    del self.groups[group]
+                    self.fetched.pop(group, None)
+                    self.rejected.pop(group, None)
+
+    def refresh_loop(self):
+        next_refresh = time.time() + args.interval
+        while True:
+            self.wakeup.wait(max(0, next_refresh - time.time()))
+            self.wakeup.clear()
+            full = time.time() >= next_refresh
+            if full:
+                next_refresh = time.time() + args.interval
+                self.expire()
+            with self.lock:
+                groups = [g for g in self.groups if full or set(self.groups[g]) - self.fetched.get(g, set())]
+            for group in groups:
+                try:
+                    self.refresh_group(group)
+                except Exception:
+                    traceback.print_exc()
+            save_api_session(self.api)
+
+
+class item_handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode('utf-8').rstrip('\r\n')
+        try:
+            fields = line.split('\t')
+            step = int(fields[4]) if len(fields) > 4 and fields[4] else 300
+            value = self.server.store.get(fields[0], fields[1], fields[2], fields[3], step)
+        except Exception:
+            value = NOT_SUPPORTED
+        self.wfile.write(('%s\n' % value).encode('utf-8'))
+
+
+class item_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    leader = get_leader(args.controller, args.user, args.password)
+    if leader is None:
+        raise SystemExit('No valid controllers found')
+    store = metric_store(leader)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = item_server(args.socket, item_handler)
+    server.store = store
+    os.chmod(args.socket, 0o666)
+    refresher = threading.Thread(target=store.refresh_loop)
+    refresher.daemon = True
+    refresher.start()
+    server.serve_forever()
@@ -3,7 +3,7 @@
 # Created on Aug 27, 2016
 # @author: Eric Anderson (eanderson@avinetworks.com)
 
-from avi.sdk.avi_api import ApiSession
+from avi_zabbix_utils import get_api_session, paginate, save_api_session
 import json
 import requests
 import argparse
@@ -18,12 +18,13 @@ parser.add_argument('-u', '--user', required=True, help='Username to authenticat
 parser.add_argument('-p', '--password', required=True, help='Password to authenticate against Avi Controller')
 args = parser.parse_args()
 
-api = ApiSession.get_session(args.controller, args.user, args.password, tenant=args.tenant)
+api = get_api_session(args.controller, args.user, args.password, tenant=args.tenant)
 
 obj_dict = { "data": [] }
-response = api.get(args.entity_type + '?page_size=1000').json()
-for obj in response['results']:
-    new_obj = { "{#OBJNAME}": obj["name"], "{#OBJTYPE}": args.entity_type, "{#OBJTENANT}": args.tenant }
+for obj in paginate(api, args.entity_type):
+    new_obj = { "{#OBJNAME}": obj["name"], "{#OBJUUID}": obj["uuid"], "{#OBJTYPE}": args.entity_type, "{#OBJTENANT}": args.tenant }
     obj_dict["data"].append(new_obj)
 
+save_api_session(api)
+
 print json.dumps(obj_dict)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+#
+# Master item for Zabbix dependent items.
+#
+# Returns the latest value of every metric of every object of one entity
+# type as a single JSON document, {"object name": {"metric_id": value}},
+# fetched with one analytics/metrics/collection call.  The dependent item
+# prototypes created by template_tools/template.py pick their value out of it
+# with JSONPath preprocessing, so a poll costs one call per entity type
+# instead of one call per object and metric.  They use -k uuid, the document
+# is then keyed by object uuid so names with quotes or backslashes do not
+# break the JSONPath.
+
+import argparse
+import json
+from avi_zabbix_utils import collection_values, get_api_session, get_leader, metric_ids, object_name, object_uuid, save_api_session
+import requests
+requests.packages.urllib3.disable_warnings()
+
+parser = argparse.ArgumentParser(description='Script used to get all stats of an entity type from Avi Vantage API into Zabbix')
+parser.add_argument('entity_type', help='The type of object')
+parser.add_argument('step', default=300, type=int, nargs='?', help='The amount of time of metric gathered')
+parser.add_argument('-t', '--tenant', default='admin', help='The name of the tenant to run against')
+parser.add_argument('-c', '--controller', required=True, help='Comma separated IP Addresses of the controllers of the cluster')
+parser.add_argument('-u', '--user', required=True, help='Username to authenticate against Avi Controller')
+parser.add_argument('-p', '--password', required=True, help='Password to authenticate against Avi Controller')
+parser.add_argument('-m', '--metrics', help='Comma separated metric ids, default all priority metrics of the entity type')
+parser.add_argument('-k', '--key', choices=['name', 'uuid'], default='name', help='Key the objects by name or by uuid (Default: name)')
+args = parser.parse_args()
+
+
+def collect(leader):
+    if leader is None:
+        raise SystemExit('No valid controllers found')
+    api = get_api_session(leader, args.user, args.password, tenant=args.tenant)
+    if args.metrics:
+        metrics = args.metrics.split(',')
+    else:
+        metrics = metric_ids(api, args.entity_type, tenant=args.tenant)
+    key = object_uuid if args.key == 'uuid' else object_name
+    return api, collection_values(api, args.entity_type, metrics, args.step, tenant=args.tenant, object_key=key)
+
+
+leader = get_leader(args.controller, args.user, args.password, tenant=args.tenant)
+try:
+    api, values = collect(leader)
+except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+    # the cached leader is gone, move to another member of the cluster
+    api, values = collect(get_leader(args.controller, args.user, args.password, tenant=args.tenant, exclude=[leader]))
+
+save_api_session(api)
+
+print(json.dumps(values, sort_keys=True))
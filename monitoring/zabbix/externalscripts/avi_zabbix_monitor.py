@@ -6,8 +6,8 @@
 import argparse
 import json
 import sys
-from avi.sdk.avi_api import ApiSession
 from avi.sdk.utils.api_utils import ApiUtils
+from avi_zabbix_utils import get_api_session, save_api_session
 import requests
 requests.packages.urllib3.disable_warnings()
 
@@ -22,7 +22,7 @@ parser.add_argument('-u', '--user', type=str, required=True, help='Username to a
 parser.add_argument('-p', '--password', type=str, required=True, help='Password to authenticate against Avi Controller')
 args = parser.parse_args()
 
-api = ApiSession.get_session(args.controller, args.user, args.password, tenant=args.tenant)
+api = get_api_session(args.controller, args.user, args.password, tenant=args.tenant)
 api_utils = ApiUtils(api)
 
 def get_metrics(entity_type, entity_name, metric_id, step, tenant):
@@ -35,3 +35,4 @@ def get_metrics(entity_type, entity_name, metric_id, step, tenant):
 
 
 print get_metrics(args.entity_type, args.entity_name, args.metric_id, args.step, args.tenant)
+save_api_session(api)
@@ -12,8 +12,11 @@
 import argparse
 import json
 import sys
+import time
+from multiprocessing.pool import ThreadPool
 from pyzabbix import *
 from avi.sdk.avi_api import ApiSession
+from avi_zabbix_utils import collection_request, collection_series, get_leader, metric_ids, object_name
 from avi.sdk.utils.api_utils import ApiUtils
 import requests
 requests.packages.urllib3.disable_warnings()
@@ -27,6 +30,10 @@ parser.add_argument('-c', '--controllers', required=True, help='Comma Seperated
 parser.add_argument('-u', '--user', required=True, help='Username to authenticate against Avi Controller')
 parser.add_argument('-p', '--password', required=True, help='Password to authenticate against Avi Controller')
 parser.add_argument('-z', '--zabbix_server', required=True, help='The Zabbix server url: format 10.10.27.198 or zabbixserver.avi.local')
+parser.add_argument('--chunk_size', type=int, default=250, help='Maximum number of values sent to Zabbix in one request')
+parser.add_argument('--chunk_bytes', type=int, default=1000000, help='Maximum approximate size in bytes of one request')
+parser.add_argument('--senders', type=int, default=4, help='Number of concurrent connections to the Zabbix server')
+parser.add_argument('--retries', type=int, default=2, help='Number of times a request that could not be delivered is sent again')
 args = parser.parse_args()
 tenant = args.tenant
 controllers = args.controllers
@@ -35,74 +42,86 @@ password = args.password
 zabbix_server = args.zabbix_server
 
 
-def get_leader(controllers):
-    exception_count = 0
-    for controller in controllers.split(","):
-        try:
-            api = ApiSession.get_session(controller, user, password, tenant=tenant)
-            cluster_runtime = api.get('cluster/runtime').json()
-            for node in cluster_runtime['node_states']:
-                if node['role'] == 'CLUSTER_LEADER':
-                    master = node['name']
-                    return master
-        except:
-            print 'Unable to connect to the controller:',controller
-            exception_count += 1
-            pass
-    if exception_count == len(controllers.split(",")):
+# Logs in to the cluster leader, exclude holds members that have failed.
+def connect(exclude=()):
+    master_controller = get_leader(controllers, user, password, tenant=tenant, exclude=exclude)
+    if master_controller is None:
         print "No valid controllers found."
         exit(1)
+    print 'Your master controller is:',master_controller
+    return master_controller, ApiSession.get_session(master_controller, user, password, tenant=tenant)
 
-def get_metrics_list(entity_type):
-    metrics = api.get('analytics/metric_id?entity_type=' + entity_type + '&priority=true').json()['results']
-    if entity_type == 'pool':
-        metrics_list = [metric['name'] for metric in metrics if not metric['name'].startswith('vm_stats')]
-    else:
-        metrics_list = [metric['name'] for metric in metrics]
-    clean_metrics_list = ','.join(metrics_list)
-    return str(clean_metrics_list)
-
+# The series are yielded while the response is received, see
+# avi_zabbix_utils.collection_series.
 def get_metrics(entity_type, metrics_list, step):
-    data = {"metric_requests":[{"step":step,"limit":1,"entity_uuid":"*", "metric_id":metrics_list, "include_name":True, "include_refs":True}]}
-    if entity_type == 'pool':
-        data['metric_requests'][0]['pool_uuid'] = "*"
-    if entity_type == 'serviceengine':
-        data['metric_requests'][0]['serviceengine_uuid'] = "*"
-    metrics_dict = api.post('/analytics/metrics/collection/', data=data, params={"include_name": True}).json()
-    return metrics_dict['series'].values()
+    for key, series in collection_series(api, collection_request(entity_type, metrics_list, step),
+                                         params={"include_name": True}):
+        yield series
 
 def format_metric(entity_type, metric, hostname):
     header = metric['header']
     tenant_ref = header['tenant_ref'].rsplit('#',1)[1]
-    print header
-    if entity_type == 'pool':
-        obj_name = header['pool_ref'].rsplit('#',1)[1]
-    else:
-        try:
-            obj_name = header['entity_ref'].rsplit('#',1)[1]
-        except:
-            obj_name = header['entity_ref']
+    obj_name = object_name(entity_type, header)
     zabbix_key = 'avi_trapper[{},{},{},{}]'.format(tenant_ref, entity_type, obj_name, header['name'])
     value = metric['data'][0]['value']
     packet = ZabbixMetric(hostname, zabbix_key, value)
     return packet
 
+# Splits the values into requests of at most chunk_size values and about
+# chunk_bytes bytes, larger requests are rejected by the trapper.
+def chunk_metrics(packets):
+    chunk = []
+    chunk_bytes = 0
+    for packet in packets:
+        packet_bytes = len(packet.host) + len(packet.key) + len(str(packet.value)) + 40
+        if chunk and (len(chunk) >= args.chunk_size or chunk_bytes + packet_bytes > args.chunk_bytes):
+            yield chunk
+            chunk = []
+            chunk_bytes = 0
+        chunk.append(packet)
+        chunk_bytes += packet_bytes
+    if chunk:
+        yield chunk
+
+# Returns the processed and failed counts the server reports for the chunk
+# and the number of values that could not be delivered.  Values the server
+# failed were received and rejected, only a chunk that was not delivered is
+# sent again.
+def send_chunk(chunk):
+    for attempt in range(args.retries + 1):
+        try:
+            result = ZabbixSender(zabbix_server=zabbix_server, chunk_size=len(chunk)).send(chunk)
+            return result.processed, result.failed, 0
+        except Exception:
+            if attempt < args.retries:
+                time.sleep(2 ** attempt)
+    return 0, 0, len(chunk)
+
+# Values are formatted and sent while the series are still being received.
 def send_metrics(entity_type, metrics, hostname):
-    for metric in metrics:
-        packet = []
-        for m in metric:
-            data = format_metric(entity_type, m, hostname)
-            print data
-            packet.append(data)
-        result = ZabbixSender(zabbix_server=zabbix_server).send(packet)
+    packets = (format_metric(entity_type, m, hostname) for metric in metrics for m in metric if m.get('data'))
+    processed = failed = undelivered = 0
+    pool = ThreadPool(args.senders)
+    try:
+        for chunk_processed, chunk_failed, chunk_undelivered in pool.imap_unordered(send_chunk, chunk_metrics(packets)):
+            processed += chunk_processed
+            failed += chunk_failed
+            undelivered += chunk_undelivered
+    finally:
+        pool.terminate()
+    print 'processed: %d; failed: %d; undelivered: %d; total: %d' % (processed, failed, undelivered, processed + failed + undelivered)
+    if undelivered:
+        exit(1)
 
-master_controller = get_leader(controllers)
-print 'Your master controller is:',master_controller
-api = ApiSession.get_session(master_controller, user, password, tenant=tenant)
+master_controller, api = connect()
+try:
+    metrics_list = metric_ids(api, args.entity_type)
+except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+    # the cached leader is gone, move to another member of the cluster
+    master_controller, api = connect(exclude=[master_controller])
+    metrics_list = metric_ids(api, args.entity_type)
 api_utils = ApiUtils(api)
 
-metrics_list = get_metrics_list(args.entity_type)
-
 metrics_data = get_metrics(args.entity_type, metrics_list, args.step)
 
 send_metrics(args.entity_type, metrics_data, args.hostname)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+#
+# Shared helpers for the Avi Zabbix external scripts.
+#
+# Zabbix starts a new process for every item poll, so the Avi login session
+# is cached on disk and reused by the next run.  The controller is only asked
+# for a new login when the cached session has expired.
+#
+# get_leader() finds the leader of a controller cluster.  Every member is
+# probed at the same time with a short timeout and the leader is cached on
+# disk for LEADER_TTL seconds, so a member that is down costs one probe
+# timeout per TTL instead of a full login timeout on every run.
+#
+# paginate() walks every page of an object collection, so collections with
+# more objects than a single page are returned completely.
+#
+# collection_series() streams the series of an analytics collection query.
+# When ijson 3.1 or later is installed the response is decoded while it is
+# received, otherwise it is decoded once, with simplejson or ujson on python
+# 2 when either is installed.
+
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
+from avi.sdk.avi_api import ApiSession
+
+try:
+    import ijson
+    if tuple(int(v) for v in ijson.__version__.split('.')[:2]) < (3, 1):
+        ijson = None
+except (ImportError, AttributeError, ValueError):
+    ijson = None
+
+# the json module of python 2 is several times slower than either of these,
+# on python 3 it is as fast
+fast_json = json
+if sys.version_info[0] == 2:
+    try:
+        import simplejson as fast_json
+    except ImportError:
+        try:
+            import ujson as fast_json
+        except ImportError:
+            pass
+
+SESSION_CACHE = os.environ.get('AVI_ZABBIX_SESSION_CACHE',
+    os.path.join(tempfile.gettempdir(), 'avi_zabbix_sessions_%s.json' % os.getuid()))
+LEADER_CACHE = os.environ.get('AVI_ZABBIX_LEADER_CACHE',
+    os.path.join(tempfile.gettempdir(), 'avi_zabbix_leaders_%s.json' % os.getuid()))
+LEADER_TTL = int(os.environ.get('AVI_ZABBIX_LEADER_TTL', 300))
+
+
+def _read_cache(path):
+    try:
+        with open(path) as cache_file:
+            return json.load(cache_file)
+    except:
+        return {}
+
+
+def _write_cache(path, data):
+    temp_file = path + '.' + str(os.getpid())
+    fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as cache_file:
+        json.dump(data, cache_file)
+    os.rename(temp_file, path)
+
+
+def _read_session_cache():
+    return _read_cache(SESSION_CACHE)
+
+
+def _write_session_cache(sessions):
+    _write_cache(SESSION_CACHE, sessions)
+
+
+def get_api_session(controller, user, password, tenant='admin', timeout=60):
+    key = controller + '|' + user
+    cached = _read_session_cache().get(key, {})
+    try:
+        # the sdk logs in again by itself if the cached session returns a 401
+        api = ApiSession.get_session(controller, user, password, tenant=tenant, timeout=timeout,
+                                     session_id=cached.get('session_id'),
+                                     csrftoken=cached.get('csrftoken'))
+    except TypeError:
+        # older avisdk releases can not be handed an existing session
+        return ApiSession.get_session(controller, user, password, tenant=tenant, timeout=timeout)
+    return api
+
+
+# Returns the member that answered and the leader it reports, or None when
+# the member can not be reached.
+def _probe_leader(member, user, password, tenant, timeout):
+    try:
+        api = get_api_session(member, user, password, tenant=tenant, timeout=timeout)
+        for node in api.get('cluster/runtime', timeout=timeout).json()['node_states']:
+            if node['role'] == 'CLUSTER_LEADER':
+                return member, node['name']
+    except Exception:
+        pass
+    return None
+
+
+# Leader of the cluster made of the comma separated controllers, None when no
+# member answers.  Members in exclude have failed for the caller, they are
+# not probed and are not returned even if another member still reports one
+# of them as leader, the member that answered is returned instead.
+def get_leader(controllers, user, password, tenant='admin', timeout=5, exclude=()):
+    members = [c.strip() for c in controllers.split(',') if c.strip()]
+    key = ','.join(sorted(members)) + '|' + user
+    cached = _read_cache(LEADER_CACHE).get(key)
+    if cached and cached['leader'] not in exclude and time.time() - cached['time'] < LEADER_TTL:
+        return cached['leader']
+    candidates = [m for m in members if m not in exclude]
+    if not candidates:
+        return None
+    leader = None
+    pool = ThreadPool(len(candidates))
+    try:
+        # the first member to answer decides, members that are down are not
+        # waited for
+        probe = lambda member: _probe_leader(member, user, password, tenant, timeout)
+        for result in pool.imap_unordered(probe, candidates):
+            if result is not None:
+                member, leader = result
+                if leader in exclude:
+                    leader = member
+                break
+    finally:
+        pool.terminate()
+    if leader is not None:
+        leaders = _read_cache(LEADER_CACHE)
+        leaders[key] = {'leader': leader, 'time': time.time()}
+        try:
+            _write_cache(LEADER_CACHE, leaders)
+        except (IOError, OSError):
+            pass
+    return leader
+
+
+def save_api_session(api):
+    session_id = getattr(api, 'session_id', None)
+    csrftoken = getattr(api, 'csrftoken', None)
+    if not session_id:
+        return
+    key = api.controller_ip + '|' + api.username
+    sessions = _read_session_cache()
+    if sessions.get(key) != {'session_id': session_id, 'csrftoken': csrftoken}:
+        sessions[key] = {'session_id': session_id, 'csrftoken': csrftoken}
+        try:
+            _write_session_cache(sessions)
+        except (IOError, OSError):
+            pass
+
+
+# The first page gives the object count, the remaining pages are fetched
+# concurrently and their objects yielded in order as each page arrives.  The
+# next links are followed afterwards in case the collection grew.
+def paginate(api, path, tenant='', page_size=1000, prefetch=4):
+    params = {'page_size': page_size}
+    resp = api.get(path, tenant=tenant, params=params).json()
+    for obj in resp.get('results', []):
+        yield obj
+    if 'next' in resp:
+        page_count = int(math.ceil(resp['count'] / float(page_size)))
+        pool = ThreadPool(prefetch)
+        try:
+            get_page = lambda page: api.get(path, tenant=tenant, params=dict(params, page=page)).json()
+            for resp in pool.imap(get_page, range(2, page_count + 1)):
+                for obj in resp.get('results', []):
+                    yield obj
+        finally:
+            pool.terminate()
+    page = int(math.ceil(resp.get('count', 0) / float(page_size)))
+    while 'next' in resp:
+        page += 1
+        resp = api.get(path, tenant=tenant, params=dict(params, page=page)).json()
+        for obj in resp.get('results', []):
+            yield obj
+
+
+# Priority metric ids of an entity type, vm_stats metrics are not available
+# per pool.
+def metric_ids(api, entity_type, tenant=''):
+    metrics = api.get('analytics/metric_id?entity_type=' + entity_type + '&priority=true', tenant=tenant).json()['results']
+    return [m['name'] for m in metrics if not (entity_type == 'pool' and m['name'].startswith('vm_stats'))]
+
+
+# Decodes a response body once.
+def decode(resp):
+    return fast_json.loads(resp.content)
+
+
+# Posts a single metric request to analytics/metrics/collection and yields
+# its (series key, metric list) pairs.  With ijson every series is yielded as
+# soon as it has been received, so neither the body nor the decoded document
+# is held in memory.
+def collection_series(api, request, tenant='', params=None):
+    resp = api.post('analytics/metrics/collection', data={"metric_requests": [request]},
+                    params=params, tenant=tenant, stream=ijson is not None)
+    try:
+        if resp.status_code < 200 or resp.status_code > 299:
+            # raises the sdk error matching the status code
+            resp.json()
+        if ijson is None:
+            series = decode(resp)['series'].get(request['id'], {}).items()
+        else:
+            resp.raw.decode_content = True
+            series = ijson.kvitems(resp.raw, 'series.' + request['id'], use_float=True)
+        for item in series:
+            yield item
+    finally:
+        resp.close()
+
+
+# Metric request for the latest value of every metric of every object of
+# entity_type.
+def collection_request(entity_type, metric_ids, step=300, request_id='collection'):
+    request = {"step": step, "limit": 1, "entity_uuid": "*", "metric_id": ','.join(metric_ids),
+               "include_name": True, "include_refs": True, "id": request_id}
+    if entity_type == 'pool':
+        request['pool_uuid'] = "*"
+    if entity_type == 'serviceengine':
+        request['serviceengine_uuid'] = "*"
+    return request
+
+
+# Name of the object a metric belongs to, pools are named after their
+# pool_ref and everything else after its entity_ref.
+def object_name(entity_type, header):
+    if entity_type == 'pool':
+        return header['pool_ref'].rsplit('#', 1)[1]
+    return header['entity_ref'].rsplit('#', 1)[-1]
+
+
+# Uuid of the object a metric belongs to, from the same ref as object_name.
+def object_uuid(entity_type, header):
+    ref = header['pool_ref'] if entity_type == 'pool' else header['entity_ref']
+    return ref.split('#', 1)[0].rsplit('/', 1)[-1]
+
+
+# Latest value of every metric of every object of entity_type with a single
+# analytics/metrics/collection call, returned as {object name: {metric: value}}.
+# Pass object_key=object_uuid to key the objects by uuid instead.
+def collection_values(api, entity_type, metric_ids, step=300, tenant='', object_key=object_name):
+    values = {}
+    for key, series in collection_series(api, collection_request(entity_type, metric_ids, step), tenant,
+                                         params={"include_name": True}):
+        for metric in series:
+            if not metric.get('data'):
+                continue
+            header = metric['header']
+            values.setdefault(object_key(entity_type, header), {})[header['name']] = metric['data'][0]['value']
+    return values
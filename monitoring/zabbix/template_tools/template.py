@@ -11,6 +11,8 @@ requests.packages.urllib3.disable_warnings()
 
 parser = argparse.ArgumentParser(description='Script used to get objects from Avi Vantage API into Zabbix')
 parser.add_argument('entity_type', help='The type of object')
+parser.add_argument('--external-check', action='store_true', help='Create an external check item per object and metric instead of dependent items of one master item')
+parser.add_argument('--step', default=5, type=int, help='Metric step in seconds the items query, 5 for realtime values (Default: 5)')
 args = parser.parse_args()
 
 user = 'Admin'
@@ -38,7 +40,49 @@ def create_avi_item(ruleid, entity_type, metric_name, metric_description):
         description=metric_description,
         value_type='3',
         interfaceid='0',
-        key_='avi_zabbix_monitor.py[' + entity_type + ',{#OBJNAME},' + metric_name + ',5]'
+        key_='avi_zabbix_monitor.py[' + entity_type + ',{#OBJNAME},' + metric_name + ',' + str(args.step) + ']'
+        )
+
+# One master item per entity type returns every metric of every object as
+# JSON, see avi_zabbix_master.py.  The controller and credentials come from
+# the {$AVI_CONTROLLER}, {$AVI_USER}, {$AVI_PASSWORD} and {$AVI_TENANT} macros,
+# {$AVI_CONTROLLER} is quoted so it can list every member of the cluster.
+def get_master_item(entity_type):
+    key = 'avi_zabbix_master.py[' + entity_type + ',' + str(args.step) + ',-k,uuid,-t,{$AVI_TENANT},-c,"{$AVI_CONTROLLER}",-u,{$AVI_USER},-p,{$AVI_PASSWORD}]'
+    items = zapi.item.get(filter={'key_': key, 'hostid': '10105'})
+    if items:
+        return items[0]['itemid']
+    return zapi.item.create(
+        hostid='10105',
+        name='Avi ' + entity_type + ' metrics',
+        type='10',
+        delay='30',
+        history='0',
+        value_type='4',
+        interfaceid='0',
+        key_=key
+        )['itemids'][0]
+
+# Dependent items take their value out of the master item with JSONPath, an
+# object without data for the metric is discarded instead of turning the item
+# unsupported.  The master item is keyed by object uuid, {#OBJUUID} is safe to
+# put in a JSONPath and an item key where a name with quotes is not.
+def create_dependent_item(ruleid, master_itemid, entity_type, metric_name, metric_description):
+    zapi.itemprototype.create(
+        ruleid=ruleid,
+        hostid='10105',
+        name='{#OBJNAME}.' + metric_name,
+        type='18',
+        master_itemid=master_itemid,
+        status='0',
+        description=metric_description,
+        value_type='0',
+        key_='avi.dependent[' + entity_type + ',{#OBJUUID},' + metric_name + ']',
+        preprocessing=[{
+            'type': '12',
+            'params': '$["{#OBJUUID}"]["' + metric_name + '"]',
+            'error_handler': '1',
+            'error_handler_params': ''}]
         )
 
 try:
@@ -49,5 +93,10 @@ except:
 
 api = ApiSession.get_session(avi_controller, avi_user, avi_password)
 metrics = api.get('analytics/metric_id?entity_type=' + args.entity_type + '&priority=true').json()['results']
-for metric in metrics:
-    create_avi_item(discoveryrule['itemid'], args.entity_type, metric['name'], metric['description'])
+if args.external_check:
+    for metric in metrics:
+        create_avi_item(discoveryrule['itemid'], args.entity_type, metric['name'], metric['description'])
+else:
+    master_itemid = get_master_item(args.entity_type)
+    for metric in metrics:
+        create_dependent_item(discoveryrule['itemid'], master_itemid, args.entity_type, metric['name'], metric['description'])
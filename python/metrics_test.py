@@ -11,7 +11,15 @@
 #
 import argparse
 import json
+import math
 import sys
+try:
+    import ijson
+    if tuple(int(v) for v in ijson.__version__.split('.')[:2]) < (3, 1):
+        ijson = None
+except (ImportError, AttributeError, ValueError):
+    ijson = None
+from multiprocessing.pool import ThreadPool
 from pyzabbix import *
 from avi.sdk.avi_api import ApiSession
 from avi.sdk.utils.api_utils import ApiUtils
@@ -32,23 +40,53 @@ user = args.user
 password = args.password
 
 
+# Every controller is asked for the leader at the same time with a short
+# timeout, the first answer is used so a controller that is down does not
+# delay the run.
 def get_leader(controllers):
-    exception_count = 0
-    for controller in controllers.split(","):
+    def probe(controller):
         try:
-            api = ApiSession.get_session(controller, user, password, tenant=tenant)
-            cluster_runtime = api.get('cluster/runtime').json()
-            for node in cluster_runtime['node_states']:
+            api = ApiSession.get_session(controller, user, password, tenant=tenant, timeout=5)
+            for node in api.get('cluster/runtime', timeout=5).json()['node_states']:
                 if node['role'] == 'CLUSTER_LEADER':
-                    master = node['name']
-                    return master
+                    return node['name']
         except:
             print 'Unable to connect to the controller:',controller
-            exception_count += 1
-            pass
-    if exception_count == len(controllers.split(",")):
-        print "No valid controllers found."
-        exit(1)
+    members = controllers.split(",")
+    pool = ThreadPool(len(members))
+    try:
+        for master in pool.imap_unordered(probe, members):
+            if master is not None:
+                return master
+    finally:
+        pool.terminate()
+    print "No valid controllers found."
+    exit(1)
+
+# Yield every object of a collection.  Pages after the first are fetched
+# concurrently and yielded in order, then next links are followed in case
+# the collection grew.
+def paginate(path, page_size=1000, prefetch=4):
+    params = {'page_size': page_size}
+    resp = api.get(path, params=params).json()
+    for obj in resp.get('results', []):
+        yield obj
+    if 'next' in resp:
+        page_count = int(math.ceil(resp['count'] / float(page_size)))
+        pool = ThreadPool(prefetch)
+        try:
+            get_page = lambda page: api.get(path, params=dict(params, page=page)).json()
+            for resp in pool.imap(get_page, range(2, page_count + 1)):
+                for obj in resp.get('results', []):
+                    yield obj
+        finally:
+            pool.terminate()
+    page = int(math.ceil(resp.get('count', 0) / float(page_size)))
+    while 'next' in resp:
+        page += 1
+        resp = api.get(path, params=dict(params, page=page)).json()
+        for obj in resp.get('results', []):
+            yield obj
 
 def get_metrics_list(entity_type):
     metrics = api.get('analytics/metric_id?entity_type=' + entity_type + '&priority=true').json()['results']
@@ -60,14 +98,26 @@ def get_metrics_list(entity_type):
     clean_metrics_list = ','.join(metrics_list)
     return str(clean_metrics_list)
 
+# Yields the series of every object.  When ijson 3.1 or later is installed
+# the response is decoded while it is received and each series is yielded as
+# soon as it is complete, otherwise the response is decoded once.
 def get_metrics(entity_type, metrics_list, step):
-    data = {"metric_requests":[{"step":step,"limit":1,"entity_uuid":"*", "metric_id":metrics_list, "include_name":True, "include_refs":True}]}
+    data = {"metric_requests":[{"step":step,"limit":1,"entity_uuid":"*", "metric_id":metrics_list, "include_name":True, "include_refs":True, "id":"metrics"}]}
     if entity_type == 'pool':
         data['metric_requests'][0]['pool_uuid'] = "*"
     if entity_type == 'serviceengine':
         data['metric_requests'][0]['serviceengine_uuid'] = "*"
-    metrics_dict = api.post('/analytics/metrics/collection/', data=data, params={"include_name": True}).json()
-    return metrics_dict['series'].values()
+    resp = api.post('analytics/metrics/collection', data=data, params={"include_name": True}, stream=ijson is not None)
+    try:
+        if ijson is None or resp.status_code != 200:
+            series = resp.json()['series'].get('metrics', {}).items()
+        else:
+            resp.raw.decode_content = True
+            series = ijson.kvitems(resp.raw, 'series.metrics', use_float=True)
+        for key, metric in series:
+            yield metric
+    finally:
+        resp.close()
 
 def format_metric(entity_type, metric):
     header = metric['header']
@@ -98,12 +148,8 @@ api = ApiSession.get_session(master_controller, user, password, tenant=tenant)
 api_utils = ApiUtils(api)
 
 print 'These objects are from the non-metrics api'
-response = api.get(args.entity_type + '?page_size=1000').json()
-#print response
-#object_list = [obj["name"] for obj in response['results']]
-#print object_list
 object_list = []
-for obj in response['results']:
+for obj in paginate(args.entity_type):
     object_list.append(obj["name"])
 print object_list
 